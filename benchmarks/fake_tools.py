@@ -0,0 +1,202 @@
+"""Offline stand-ins for yt-dlp and ffmpeg used by the benchmark harness.
+
+They accept the arguments the downloader passes, sleep to simulate network and
+encode time, and write placeholder files where the real tools would.
+FakeYtdlpPool does the same for the in-process yt-dlp mode. Behaviour is tuned
+through environment variables:
+
+- BENCH_MEDIA_BYTES      size of each downloaded audio stream (default 4 MiB)
+- BENCH_LATENCY          seconds one download takes (default 0.5)
+- BENCH_METADATA_LATENCY seconds one extraction takes (default 0.1)
+- BENCH_ENCODE_SECONDS   seconds one ffmpeg run takes (default 0.2)
+- BENCH_FAIL_RATE        fraction of downloads failing with HTTP 429 (default 0)
+- BENCH_PLAYLIST_SIZE    entries returned for a playlist URL (default 20)
+"""
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, Any, List, Optional
+
+PROGRESS_STEPS = 10
+
+
+def _env(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+def _option(args: List[str], name: str) -> Optional[str]:
+    if name in args:
+        return args[args.index(name) + 1]
+    return None
+
+
+def _video_id(url: str) -> str:
+    match = re.search(r"(?:v=|youtu\.be/|soundcloud\.com/)([\w/-]+)", url)
+    return (match.group(1) if match else url).replace("/", "-")
+
+
+def _info(url: str) -> Dict[str, Any]:
+    video_id = _video_id(url)
+    return {
+        "id": video_id,
+        "title": f"Benchmark Track {video_id}",
+        "uploader": "Benchmark Artist",
+        "release_date": "20240101",
+        "duration": 180,
+        "ext": "webm",
+        "original_url": url,
+        "webpage_url": url,
+    }
+
+
+def ytdlp(args: List[str]) -> int:
+    if "--flat-playlist" in args:
+        url = args[-1]
+        size = int(_env("BENCH_PLAYLIST_SIZE", 20))
+        entries = [_info(f"https://www.youtube.com/watch?v=bench{i:06d}") for i in range(size)]
+        print(json.dumps({"title": f"Benchmark Playlist {_video_id(url)}", "entries": entries}))
+        return 0
+
+    if "--dump-json" in args:
+        urls = sys.stdin.read().split() if _option(args, "--batch-file") == "-" else [args[-1]]
+        for url in urls:
+            time.sleep(_env("BENCH_METADATA_LATENCY", 0.1))
+            print(json.dumps(_info(url)), flush=True)
+        return 0
+
+    info_file = _option(args, "--load-info-json")
+    if info_file:
+        with open(info_file) as f:
+            info = json.load(f)
+    else:
+        time.sleep(_env("BENCH_METADATA_LATENCY", 0.1))
+        info = _info(args[-1])
+
+    error = _failure(info)
+    if error:
+        print(error, file=sys.stderr)
+        return 1
+
+    def report(done: int, size: int, speed: float, eta: float) -> None:
+        print(f"[progress] {done} {size} {speed:.0f} {eta:.0f}", flush=True)
+
+    _write_media(info, args, _option(args, "--output") or "%(id)s.%(ext)s", report)
+    return 0
+
+
+def _failure(info: Dict[str, Any]) -> Optional[str]:
+    if random.random() < _env("BENCH_FAIL_RATE", 0):
+        return f"ERROR: [youtube] {info['id']}: HTTP Error 429: Too Many Requests"
+    return None
+
+
+def _write_media(
+    info: Dict[str, Any],
+    args: List[str],
+    template: str,
+    report: Callable[[int, int, float, float], None],
+    deadline: Optional[float] = None,
+) -> None:
+    size = int(_env("BENCH_MEDIA_BYTES", 4 * 1024 * 1024))
+    latency = _env("BENCH_LATENCY", 0.5)
+    chunk = b"\0" * (size // PROGRESS_STEPS)
+    with open(template.replace("%(ext)s", "webm").replace("%(id)s", info["id"]), "wb") as f:
+        for step in range(1, PROGRESS_STEPS + 1):
+            time.sleep(latency / PROGRESS_STEPS)
+            if deadline is not None and time.monotonic() > deadline:
+                raise subprocess.TimeoutExpired(["yt-dlp", *args], latency)
+            f.write(chunk)
+            report(len(chunk) * step, size, size / latency, latency * (1 - step / PROGRESS_STEPS))
+    if "--write-thumbnail" in args:
+        with open(template.replace("%(ext)s", "jpg").replace("%(id)s", info["id"]), "wb") as f:
+            f.write(b"\xff\xd8\xff" + b"\0" * 1024)
+
+
+class FakeYtdlpPool:
+    """Drop-in for core.ytdlp_pool.YtdlpPool that behaves like the yt-dlp stub without a process.
+
+    It exercises the downloader's in-process path (progress hooks, error and
+    timeout mapping, no process per call), not yt-dlp's own extractors.
+    """
+
+    def extract(self, args: List[str], url: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        time.sleep(_env("BENCH_METADATA_LATENCY", 0.1))
+        return _info(url)
+
+    def download(
+        self,
+        args: List[str],
+        outtmpl: str,
+        url: Optional[str] = None,
+        info_file: Optional[str] = None,
+        on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        deadline = time.monotonic() + timeout if timeout else None
+        if info_file:
+            with open(info_file) as f:
+                info = json.load(f)
+        else:
+            info = self.extract(args, url or "")
+        error = _failure(info)
+        if error:
+            raise subprocess.CalledProcessError(1, ["yt-dlp", *args, url or info_file or ""], "", error)
+
+        def report(done: int, size: int, speed: float, eta: float) -> None:
+            if on_progress:
+                on_progress({"status": "downloading", "downloaded_bytes": done, "total_bytes": size, "speed": speed, "eta": eta})
+
+        _write_media(info, args, outtmpl, report, deadline)
+
+
+EBUR128_SUMMARY = """[Parsed_ebur128_0 @ 0x0] Summary:
+
+  Integrated loudness:
+    I:         -11.2 LUFS
+    Threshold: -21.5 LUFS
+
+  Loudness range:
+    LRA:         6.1 LU
+    Threshold:  -31.4 LUFS
+    LRA low:    -15.3 LUFS
+    LRA high:    -9.2 LUFS
+
+  True peak:
+    Peak:        0.8 dBFS
+"""
+LOUDNORM_JSON = {"input_i": "-11.20", "input_tp": "0.80", "input_lra": "6.10", "input_thresh": "-21.50"}
+
+
+def ffmpeg(args: List[str]) -> int:
+    inputs = [args[i + 1] for i, arg in enumerate(args) if arg == "-i"]
+    output: Optional[str] = args[-1]
+    if output == "-":
+        # A trailing "-map ... -f null -" output only measures; the file, if any, is written before it
+        output = args[len(args) - 1 - args[::-1].index("-map") - 1]
+        if output in inputs:
+            output = None
+    seconds = _env("BENCH_ENCODE_SECONDS", 0.2)
+    progress = "pipe:1" in args
+    for step in range(1, PROGRESS_STEPS + 1):
+        time.sleep(seconds / PROGRESS_STEPS)
+        if progress:
+            print(f"out_time_us={int(180_000_000 * step / PROGRESS_STEPS)}\nspeed=100x", flush=True)
+            print("progress=continue" if step < PROGRESS_STEPS else "progress=end", flush=True)
+    if output and inputs and os.path.exists(inputs[0]):
+        shutil.copyfile(inputs[0], output)
+    if any(arg.startswith("ebur128") for arg in args):
+        print(EBUR128_SUMMARY, file=sys.stderr)
+    if any(arg.startswith("loudnorm") for arg in args):
+        print(f"[Parsed_loudnorm_0 @ 0x0] \n{json.dumps(LOUDNORM_JSON, indent=1)}", file=sys.stderr)
+    return 0
+
+
+TOOLS = {"yt-dlp": ytdlp, "ffmpeg": ffmpeg}
+
+if __name__ == "__main__":
+    sys.exit(TOOLS[sys.argv[1]](sys.argv[2:]))
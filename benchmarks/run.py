@@ -0,0 +1,304 @@
+"""Offline throughput benchmark for the download pipeline.
+
+Stub yt-dlp/ffmpeg executables (benchmarks/fake_tools.py) are put first
+on PATH and HOME points at a scratch directory, so nothing touches the network
+or the real download folder. The harness then drives the CLI (one process per
+track, or one process for all tracks) and/or the FastAPI /download endpoint (in-process, with the real job
+queue) and reports latency percentiles, jobs/sec and resource peaks.
+
+The server target can also run yt-dlp in-process (--ytdlp-mode inprocess) with
+fake_tools.FakeYtdlpPool in place of the worker pool; CLI processes always use
+the yt-dlp stub executable.
+
+    python -m benchmarks.run --jobs 50 --concurrency 8 --target server
+    python -m benchmarks.run --jobs 50 --target server --ytdlp-mode inprocess
+    BENCH_FAIL_RATE=0.2 python -m benchmarks.run --target all --json
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+# Pipeline stages reported per job, in pipeline order
+STAGES = ["queue_wait", "metadata_fetch", "download", "thumbnail_conversion", "encode_tag", "loudness_tag", "cleanup", "total"]
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": max(values, default=0.0),
+    }
+
+
+def max_rss_mb(who: int) -> float:
+    rss = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def open_fds() -> int:
+    for fd_dir in ("/proc/self/fd", "/dev/fd"):
+        if os.path.isdir(fd_dir):
+            return len(os.listdir(fd_dir))
+    return 0
+
+
+class ResourceSampler:
+    """Samples open file descriptors and live threads of this process in the background"""
+
+    def __init__(self, interval: float = 0.05) -> None:
+        self.interval = interval
+        self.peak_fds = 0
+        self.peak_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak_fds = max(self.peak_fds, open_fds())
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "ResourceSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def install_stubs(bin_dir: Path) -> Dict[str, str]:
+    """Write yt-dlp/ffmpeg wrapper scripts that run fake_tools with this interpreter"""
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    paths: Dict[str, str] = {}
+    for tool in ("yt-dlp", "ffmpeg"):
+        path = bin_dir / tool
+        path.write_text(
+            f"#!{sys.executable}\n"
+            "import sys\n"
+            f"sys.path.insert(0, {str(REPO_ROOT)!r})\n"
+            "from benchmarks.fake_tools import TOOLS\n"
+            f"sys.exit(TOOLS[{tool!r}](sys.argv[1:]))\n"
+        )
+        path.chmod(0o755)
+        paths[tool] = str(path)
+    return paths
+
+
+def track_urls(count: int, run: str) -> List[str]:
+    return [f"https://www.youtube.com/watch?v={run}{i:06d}" for i in range(count)]
+
+
+def bench_cli(urls: List[str], concurrency: int, env: Dict[str, str]) -> Dict[str, Any]:
+    """Run one `python -m core.cli URL` process per track, `concurrency` at a time"""
+
+    def run(url: str) -> Dict[str, Any]:
+        start = time.monotonic()
+        result = subprocess.run(
+            [sys.executable, "-m", "core.cli", url], cwd=REPO_ROOT, env=env, capture_output=True, text=True
+        )
+        return {"ok": result.returncode == 0, "seconds": time.monotonic() - start, "output": result.stdout[-300:]}
+
+    with ResourceSampler() as sampler:
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(run, urls))
+        wall = time.monotonic() - start
+
+    failures = [r for r in results if not r["ok"]]
+    for failure in failures[:3]:
+        print(f"CLI failure: {failure['output']}", file=sys.stderr)
+    return {
+        "target": "cli",
+        "jobs": len(urls),
+        "failed": len(failures),
+        "wall_seconds": wall,
+        "jobs_per_second": len(urls) / wall if wall else 0.0,
+        "stages": {"total": summarize([r["seconds"] for r in results])},
+        "peak_rss_mb": max_rss_mb(resource.RUSAGE_SELF),
+        "peak_child_rss_mb": max_rss_mb(resource.RUSAGE_CHILDREN),
+        "peak_fds": sampler.peak_fds,
+        "peak_threads": sampler.peak_threads,
+    }
+
+
+def bench_cli_multi(urls: List[str], concurrency: int, env: Dict[str, str]) -> Dict[str, Any]:
+    """Run a single `python -m core.cli --jobs N URL...` process for all tracks"""
+    with ResourceSampler() as sampler:
+        start = time.monotonic()
+        result = subprocess.run(
+            [sys.executable, "-m", "core.cli", "--jobs", str(concurrency)] + urls,
+            cwd=REPO_ROOT, env=env, capture_output=True, text=True,
+        )
+        wall = time.monotonic() - start
+
+    failed = result.stdout.count("❌") + result.stderr.count("❌")
+    if result.returncode != 0:
+        print(f"CLI failure: {(result.stdout + result.stderr)[-300:]}", file=sys.stderr)
+        failed = failed or len(urls)
+    return {
+        "target": "cli-multi",
+        "jobs": len(urls),
+        "failed": failed,
+        "wall_seconds": wall,
+        "jobs_per_second": len(urls) / wall if wall else 0.0,
+        "stages": {"total": summarize([wall])},
+        "peak_rss_mb": max_rss_mb(resource.RUSAGE_SELF),
+        "peak_child_rss_mb": max_rss_mb(resource.RUSAGE_CHILDREN),
+        "peak_fds": sampler.peak_fds,
+        "peak_threads": sampler.peak_threads,
+    }
+
+
+def bench_server(urls: List[str], ytdlp_mode: str, poll: float = 0.05) -> Dict[str, Any]:
+    """POST every URL to /download, then wait for the job queue (SPOTIFYTOOL_WORKERS workers) to finish them"""
+    from fastapi.testclient import TestClient
+
+    from core.jobs import FINISHED_STATES
+    from core.server import app, job_queue
+
+    # The pipeline prints a line per finished file; keep stdout for the report
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull), ResourceSampler() as sampler, TestClient(app) as client:
+        start = time.monotonic()
+        job_ids = [client.post("/download", json={"url": url}).json()["job_id"] for url in urls]
+        submitted = time.monotonic() - start
+        while True:
+            jobs = [job_queue.get(job_id) for job_id in job_ids]
+            if all(job is None or job.state in FINISHED_STATES for job in jobs):
+                break
+            time.sleep(poll)
+        wall = time.monotonic() - start
+
+    done = [job for job in jobs if job and job.state == "done"]
+    stages: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    for job in done:
+        for stage in STAGES[:-1]:
+            if stage in job.stats:
+                stages[stage].append(job.stats[stage])
+        stages["total"].append(job.finished_at - job.created_at)
+    for job in jobs:
+        if job and job.state != "done":
+            print(f"Job [{job.id}] {job.state}: {job.error}", file=sys.stderr)
+    return {
+        "target": "server",
+        "ytdlp_mode": ytdlp_mode,
+        "jobs": len(urls),
+        "failed": len(urls) - len(done),
+        "submit_seconds": submitted,
+        "wall_seconds": wall,
+        "jobs_per_second": len(urls) / wall if wall else 0.0,
+        "stages": {stage: summarize(values) for stage, values in stages.items() if values},
+        "peak_rss_mb": max_rss_mb(resource.RUSAGE_SELF),
+        "peak_child_rss_mb": max_rss_mb(resource.RUSAGE_CHILDREN),
+        "peak_fds": sampler.peak_fds,
+        "peak_threads": sampler.peak_threads,
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    mode = f" (yt-dlp {report['ytdlp_mode']})" if "ytdlp_mode" in report else ""
+    print(f"\n== {report['target']}{mode}: {report['jobs']} jobs, {report['failed']} failed ==")
+    print(f"wall {report['wall_seconds']:.2f}s, {report['jobs_per_second']:.2f} jobs/s")
+    print(f"peak RSS {report['peak_rss_mb']:.1f} MB (largest child {report['peak_child_rss_mb']:.1f} MB), peak fds {report['peak_fds']}, peak threads {report['peak_threads']}")
+    print(f"{'stage':<22}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+    for stage, s in report["stages"].items():
+        print(f"{stage:<22}{s['p50']:>9.3f}{s['p90']:>9.3f}{s['p99']:>9.3f}{s['max']:>9.3f}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=20, help="tracks to download")
+    parser.add_argument("--concurrency", type=int, default=4, help="CLI processes / server download workers")
+    parser.add_argument("--target", choices=["cli", "cli-multi", "server", "all"], default="server")
+    parser.add_argument("--media-mb", type=float, default=4, help="size of each fake audio stream")
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds each fake download takes")
+    parser.add_argument("--encode-seconds", type=float, default=0.2, help="seconds each fake ffmpeg run takes")
+    parser.add_argument("--loudness", choices=["off", "tag", "apply"], default="off", help="loudness handling per track")
+    parser.add_argument(
+        "--ytdlp-mode", choices=["subprocess", "inprocess"], default="subprocess",
+        help="how the server target runs yt-dlp: the stub executable or a fake in-process pool",
+    )
+    parser.add_argument("--json", action="store_true", help="print the reports as JSON")
+    args = parser.parse_args(argv)
+    if args.ytdlp_mode == "inprocess" and args.target in ("cli", "cli-multi"):
+        parser.error("--ytdlp-mode inprocess only applies to the server target")
+
+    scratch = Path(tempfile.mkdtemp(prefix="spotifytool-bench-"))
+    stubs = install_stubs(scratch / "bin")
+    env = {
+        "HOME": str(scratch / "home"),
+        "PATH": f"{scratch / 'bin'}{os.pathsep}{os.environ.get('PATH', '')}",
+        # CLI processes can only use the stub executables; nothing here should be throttled
+        "SPOTIFYTOOL_YTDLP_MODE": "subprocess",
+        "SPOTIFYTOOL_RATE_LIMIT": "0",
+        "SPOTIFYTOOL_RETRY_DELAY": "0.1",
+        "SPOTIFYTOOL_WORKERS": str(args.concurrency),
+        "BENCH_MEDIA_BYTES": str(int(args.media_mb * 1024 * 1024)),
+        "BENCH_LATENCY": str(args.latency),
+        "BENCH_ENCODE_SECONDS": str(args.encode_seconds),
+        "SPOTIFYTOOL_LOUDNESS": args.loudness,
+    }
+    os.environ.update(env)
+    os.chdir(REPO_ROOT)
+    sys.path.insert(0, str(REPO_ROOT))
+
+    # Import only now, so module-level paths (HOME, tool lookup) see the environment above
+    import core.downloader as downloader
+
+    downloader.YTDLP_PATH = stubs["yt-dlp"]
+    downloader.FFMPEG_PATH = stubs["ffmpeg"]
+    if args.ytdlp_mode == "inprocess":
+        from benchmarks.fake_tools import FakeYtdlpPool
+
+        downloader.YTDLP_MODE = "inprocess"
+        downloader.ytdlp_pool = FakeYtdlpPool()
+    import logging
+
+    # Keep benchmark logs out of the real server log
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.FileHandler(scratch / "bench.log"))
+
+    benches: List[Callable[[], Dict[str, Any]]] = []
+    if args.target in ("cli", "all"):
+        benches.append(lambda: bench_cli(track_urls(args.jobs, "cli"), args.concurrency, {**os.environ, **env}))
+    if args.target in ("cli-multi", "all"):
+        benches.append(lambda: bench_cli_multi(track_urls(args.jobs, "multi"), args.concurrency, {**os.environ, **env}))
+    if args.target in ("server", "all"):
+        benches.append(lambda: bench_server(track_urls(args.jobs, "srv"), args.ytdlp_mode))
+
+    reports = [bench() for bench in benches]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        for report in reports:
+            print_report(report)
+        print(f"\nScratch directory (logs, downloads): {scratch}")
+    return 1 if any(report["failed"] for report in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,443 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional, Any, Iterator, List, Tuple
+
+
+class SqliteStore:
+    """Base for the small SQLite tables kept in the download directory.
+
+    Subclasses set SCHEMA; the database and table are created on first use.
+    Columns added after a table first shipped go in MIGRATIONS as
+    (table, column, type), and are added to existing databases.
+    """
+
+    SCHEMA: str = ""
+    MIGRATIONS: List[Tuple[str, str, str]] = []
+
+    def __init__(self, db_path: Path) -> None:
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        self._ensure_schema()
+        conn = self._open()
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.db_path), timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _ensure_schema(self) -> None:
+        if self._initialized:
+            return
+        with self._lock:
+            if self._initialized:
+                return
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = self._open()
+            try:
+                with conn:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(self.SCHEMA)
+                    for table, column, column_type in self.MIGRATIONS:
+                        columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+                        if column not in columns:
+                            try:
+                                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+                            except sqlite3.OperationalError as e:
+                                # Another process opening the same database added it first
+                                if "duplicate column name" not in str(e):
+                                    raise
+                    self._after_schema(conn)
+            finally:
+                conn.close()
+            self._initialized = True
+
+    def _after_schema(self, conn: sqlite3.Connection) -> None:
+        """Hook for one-off data fixes once the schema is in place"""
+
+
+class DownloadCache(SqliteStore):
+    """Persistent index mapping canonical track IDs to finished files.
+
+    Entries whose file has been moved or deleted are treated as misses and
+    dropped on lookup.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS downloads (
+            key TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            path TEXT NOT NULL,
+            title TEXT,
+            artist TEXT,
+            release_date TEXT,
+            created_at REAL NOT NULL
+        );
+    """
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM downloads WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if not Path(row["path"]).exists():
+                logging.info(f"Cached file for {key} is gone, dropping cache entry: {row['path']}")
+                conn.execute("DELETE FROM downloads WHERE key = ?", (key,))
+                return None
+            return dict(row)
+
+    def put(
+        self,
+        key: str,
+        url: str,
+        path: Path,
+        title: Optional[str] = None,
+        artist: Optional[str] = None,
+        release_date: Optional[str] = None,
+    ) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO downloads (key, url, path, title, artist, release_date, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, url, str(path), title, artist, release_date, time.time()),
+            )
+
+
+class InfoCache(SqliteStore):
+    """yt-dlp info JSON keyed by canonical track ID: an in-memory LRU in front of a
+    persistent table. Callers pass the maximum age they accept, since stream URLs
+    inside the info expire long before titles and uploaders change.
+
+    Each entry records the extractor arguments (e.g. player clients) it was
+    extracted with, since stream URLs only work with the client that fetched
+    them. Rows older than ttl are deleted at startup and then about once per
+    prune_interval seconds on write.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS info (
+            key TEXT PRIMARY KEY,
+            data BLOB NOT NULL,
+            fetched_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS info_fetched ON info (fetched_at);
+    """
+    MIGRATIONS = [("info", "extractor", "TEXT NOT NULL DEFAULT ''")]
+
+    def __init__(self, db_path: Path, memory_size: int = 64, ttl: float = 7 * 24 * 3600, prune_interval: float = 3600) -> None:
+        super().__init__(db_path)
+        self.memory_size = memory_size
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+        self._pruned_at = time.time()
+        self._memory: "OrderedDict[str, tuple[float, str, Dict[str, Any]]]" = OrderedDict()
+        self._memory_lock = threading.Lock()
+
+    def _after_schema(self, conn: sqlite3.Connection) -> None:
+        self._prune(conn)
+
+    def _prune(self, conn: sqlite3.Connection) -> None:
+        removed = conn.execute("DELETE FROM info WHERE fetched_at < ?", (time.time() - self.ttl,)).rowcount
+        if removed:
+            logging.info(f"Pruned {removed} expired entries from the info cache")
+
+    def _remember(self, key: str, fetched_at: float, extractor: str, info: Dict[str, Any]) -> None:
+        with self._memory_lock:
+            self._memory[key] = (fetched_at, extractor, info)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str, max_age: float, extractor: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """The cached info if at most max_age seconds old and, when extractor is
+        given, extracted with exactly those extractor arguments"""
+        now = time.time()
+        with self._memory_lock:
+            entry = self._memory.get(key)
+            if entry:
+                self._memory.move_to_end(key)
+        if entry is None:
+            with self._connect() as conn:
+                row = conn.execute("SELECT data, fetched_at, extractor FROM info WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            entry = (row["fetched_at"], row["extractor"], json.loads(zlib.decompress(row["data"])))
+            self._remember(key, *entry)
+        fetched_at, cached_extractor, info = entry
+        if now - fetched_at > max_age:
+            return None
+        if extractor is not None and extractor != cached_extractor:
+            return None
+        return info
+
+    def put(self, key: str, info: Dict[str, Any], extractor: str = "") -> None:
+        fetched_at = time.time()
+        self._remember(key, fetched_at, extractor, info)
+        data = zlib.compress(json.dumps(info).encode("utf-8"))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO info (key, data, fetched_at, extractor) VALUES (?, ?, ?, ?)",
+                (key, data, fetched_at, extractor),
+            )
+            if fetched_at - self._pruned_at > self.prune_interval:
+                self._pruned_at = fetched_at
+                self._prune(conn)
+
+
+class JobJournal(SqliteStore):
+    """Durable record of unfinished server jobs, so a restart can re-queue them.
+
+    A row is written when a job is queued, updated on every state change and
+    deleted once the job finishes. Temp files are named after the job ID, so a
+    re-queued job picks up its partial download where it stopped.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            title TEXT,
+            platform TEXT NOT NULL,
+            audio_format TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            resumes INTEGER NOT NULL DEFAULT 0
+        );
+    """
+    MIGRATIONS = [("jobs", "clip_start", "REAL"), ("jobs", "clip_end", "REAL"), ("jobs", "loudness", "TEXT")]
+
+    def add(
+        self,
+        job_id: str,
+        url: str,
+        title: Optional[str],
+        platform: str,
+        audio_format: str,
+        key: str,
+        state: str,
+        created_at: float,
+        clip_start: Optional[float] = None,
+        clip_end: Optional[float] = None,
+        loudness: Optional[str] = None,
+    ) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs "
+                "(id, url, title, platform, audio_format, key, state, created_at, updated_at, clip_start, clip_end, loudness) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id, url, title, platform, audio_format, key, state, created_at, time.time(),
+                    clip_start, clip_end, loudness,
+                ),
+            )
+
+    def set_state(self, job_id: str, state: str) -> None:
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?", (state, time.time(), job_id))
+
+    def remove(self, job_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def resume(self) -> List[Dict[str, Any]]:
+        """Return the unfinished jobs, oldest first, counting this as one more resume for each"""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET resumes = resumes + 1")
+            rows = conn.execute("SELECT * FROM jobs ORDER BY created_at").fetchall()
+        return [dict(row) for row in rows]
+
+
+class LibraryIndex(SqliteStore):
+    """Every finished file in the library, so listing, searching and picking a
+    free filename never have to walk the download directory.
+
+    audio_hash is a SHA-1 of the downloaded stream before tagging, so the same
+    recording saved under different names or URLs can be found. Files written
+    with ReplayGain tags also keep their loudness measurement here.
+
+    Rows for files deleted from disk are dropped whenever a listing comes across
+    them, so opening the store never stats the whole library.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS library (
+            path TEXT PRIMARY KEY,
+            key TEXT NOT NULL,
+            url TEXT,
+            title TEXT,
+            artist TEXT,
+            audio_format TEXT,
+            duration REAL,
+            size INTEGER,
+            audio_hash TEXT,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS library_key ON library (key);
+        CREATE INDEX IF NOT EXISTS library_title ON library (title COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS library_artist ON library (artist COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS library_hash ON library (audio_hash);
+        CREATE INDEX IF NOT EXISTS library_created ON library (created_at);
+    """
+    MIGRATIONS = [
+        ("library", "loudness_lufs", "REAL"),
+        ("library", "true_peak_dbfs", "REAL"),
+        ("library", "loudness_range_lu", "REAL"),
+    ]
+    LOUDNESS_COLUMNS: Tuple[str, ...] = ("loudness_lufs", "true_peak_dbfs", "loudness_range_lu")
+
+    def __init__(self, db_path: Path) -> None:
+        super().__init__(db_path)
+        # Paths picked by downloads that haven't written their file yet, by request ID
+        self._claims: Dict[str, Path] = {}
+        self._claims_lock = threading.Lock()
+
+    def _after_schema(self, conn: sqlite3.Connection) -> None:
+        # Index what the download cache already knew about before the library existed
+        has_downloads = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'downloads'").fetchone()
+        if has_downloads:
+            conn.execute(
+                "INSERT OR IGNORE INTO library (path, key, url, title, artist, created_at) "
+                "SELECT path, key, url, title, artist, created_at FROM downloads"
+            )
+
+    def _drop_missing(self, conn: sqlite3.Connection, rows: List[sqlite3.Row]) -> bool:
+        """Delete the rows among rows whose file is gone; True if there were any"""
+        missing = [(row["path"],) for row in rows if not Path(row["path"]).exists()]
+        if missing:
+            logging.info(f"{len(missing)} library files are gone, dropping their entries")
+            conn.executemany("DELETE FROM library WHERE path = ?", missing)
+        return bool(missing)
+
+    def claim_path(self, unique_id: str, path: Path, key: str) -> Path:
+        """Return path, or "name (2).ext", "name (3).ext"... if it belongs to another
+        track or another running download. The same track may overwrite its own file.
+        """
+        with self._claims_lock:
+            claimed = {p for owner, p in self._claims.items() if owner != unique_id}
+            candidate = path
+            n = 1
+            while True:
+                if candidate not in claimed and (not candidate.exists() or self.owner(candidate) == key):
+                    break
+                n += 1
+                candidate = path.with_name(f"{path.stem} ({n}){path.suffix}")
+            self._claims[unique_id] = candidate
+        if candidate != path:
+            logging.info(f"[{unique_id}] {path.name} is taken by another track, saving as {candidate.name}")
+        return candidate
+
+    def release(self, unique_id: str) -> None:
+        with self._claims_lock:
+            self._claims.pop(unique_id, None)
+
+    def owner(self, path: Path) -> Optional[str]:
+        """Key of the track indexed at path, if any"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT key FROM library WHERE path = ?", (str(path),)).fetchone()
+        return row["key"] if row else None
+
+    def put(
+        self,
+        path: Path,
+        key: str,
+        url: str,
+        title: Optional[str],
+        artist: Optional[str],
+        audio_format: str,
+        duration: Optional[float],
+        size: int,
+        audio_hash: Optional[str],
+        loudness: Optional[Dict[str, float]] = None,
+    ) -> None:
+        measured = [(loudness or {}).get(column) for column in self.LOUDNESS_COLUMNS]
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO library "
+                "(path, key, url, title, artist, audio_format, duration, size, audio_hash, created_at, "
+                f"{', '.join(self.LOUDNESS_COLUMNS)}) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (str(path), key, url, title, artist, audio_format, duration, size, audio_hash, time.time(), *measured),
+            )
+
+    def set_loudness(self, path: Path, loudness: Dict[str, float]) -> None:
+        """Record the measurement of a file tagged after it was indexed"""
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE library SET {', '.join(f'{column} = ?' for column in self.LOUDNESS_COLUMNS)} WHERE path = ?",
+                (*(loudness.get(column) for column in self.LOUDNESS_COLUMNS), str(path)),
+            )
+
+    def loudness(self, path: Optional[Path] = None, audio_hash: Optional[str] = None) -> Optional[Dict[str, float]]:
+        """Loudness measured for the file at path, or for any file holding audio_hash"""
+        column, value = ("path", str(path)) if path is not None else ("audio_hash", audio_hash)
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(self.LOUDNESS_COLUMNS)} FROM library "
+                f"WHERE {column} = ? AND loudness_lufs IS NOT NULL LIMIT 1",
+                (value,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {name: row[name] for name in self.LOUDNESS_COLUMNS if row[name] is not None}
+
+    def search(
+        self,
+        query: Optional[str] = None,
+        artist: Optional[str] = None,
+        limit: int = 100,
+        offset: int = 0,
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """Newest first; query matches title or artist, case-insensitively. Returns (total, page)"""
+        where: List[str] = []
+        params: List[Any] = []
+        if query:
+            where.append("(title LIKE ? OR artist LIKE ?)")
+            params += [f"%{query}%", f"%{query}%"]
+        if artist:
+            where.append("artist LIKE ?")
+            params.append(artist)
+        clause = f"WHERE {' AND '.join(where)}" if where else ""
+        with self._connect() as conn:
+            # Each pass deletes at least one stale row, so this ends; the total is counted after
+            while True:
+                rows = conn.execute(
+                    f"SELECT * FROM library {clause} ORDER BY created_at DESC LIMIT ? OFFSET ?", params + [limit, offset]
+                ).fetchall()
+                if not self._drop_missing(conn, rows):
+                    break
+            total = conn.execute(f"SELECT COUNT(*) FROM library {clause}", params).fetchone()[0]
+        return total, [dict(row) for row in rows]
+
+    def duplicates(self) -> List[List[Dict[str, Any]]]:
+        """Groups of files holding the same downloaded audio"""
+        with self._connect() as conn:
+            while True:
+                rows = conn.execute(
+                    "SELECT * FROM library WHERE audio_hash IN "
+                    "(SELECT audio_hash FROM library WHERE audio_hash IS NOT NULL GROUP BY audio_hash HAVING COUNT(*) > 1) "
+                    "ORDER BY audio_hash, created_at"
+                ).fetchall()
+                # A group may fall below two files once its stale rows are gone
+                if not self._drop_missing(conn, rows):
+                    break
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            groups.setdefault(row["audio_hash"], []).append(dict(row))
+        return list(groups.values())
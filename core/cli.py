@@ -1,9 +1,23 @@
+import json
+import sys
+import threading
+import time
+from typing import IO, Optional, Dict, Any, List
+
 import typer
-from typing import Optional
 
-from core.downloader import download_audio
+# Only typer and the standard library are imported up front, so --help and
+# --server runs start quickly. The downloader (yt-dlp, SQLite stores, encode
+# pool) is imported by the commands that download in-process.
+
+# Plain help output: rendering it with rich costs more than the rest of startup
+app = typer.Typer(rich_markup_mode=None, pretty_exceptions_enable=False)
 
-app = typer.Typer()
+FINISHED_STATES = ("done", "failed")
+# Seconds between job status polls when delegating to a server
+SERVER_POLL_INTERVAL: float = 0.5
+# Minimum seconds between redraws of the live status line
+STATUS_INTERVAL: float = 0.1
 
 def identify_platform(url: str) -> str:
     if "youtube.com" in url or "youtu.be" in url:
@@ -13,19 +27,360 @@ def identify_platform(url: str) -> str:
     else:
         raise ValueError("Unsupported platform. Only YouTube and SoundCloud are supported.")
 
-@app.command()
-def main(url: str = typer.Argument(..., help="YouTube or SoundCloud URL")) -> None:
-    try:
+def read_urls(urls: List[str], input_file: Optional[str]) -> List[str]:
+    """URLs from the arguments and input_file, one per line ("-" reads stdin).
+
+    Stdin is also read when no URL is given and it isn't a terminal. Blank
+    lines and # comments are skipped, and repeated URLs are downloaded once.
+    """
+    lines: List[str] = [url for url in urls if url != "-"]
+    read_stdin = "-" in urls or input_file == "-" or (not urls and not input_file and not sys.stdin.isatty())
+    if input_file and input_file != "-":
+        with open(input_file) as f:
+            lines += f.read().splitlines()
+    if read_stdin:
+        lines += sys.stdin.read().splitlines()
+    cleaned = [line.strip() for line in lines]
+    return list(dict.fromkeys(line for line in cleaned if line and not line.startswith("#")))
+
+def print_library(query: Optional[str], limit: int) -> None:
+    from core.downloader import library, format_timestamp
+
+    total, items = library.search(query, limit=limit)
+    for item in items:
+        details = [item["audio_format"] or "?"]
+        if item["duration"]:
+            details.append(format_timestamp(item["duration"]))
+        if item["size"]:
+            details.append(f"{item['size'] / 2**20:.1f} MB")
+        name = f"{item['artist']} - {item['title']}" if item["artist"] else item["title"]
+        typer.echo(f"{name}  [{', '.join(details)}]  {item['path']}")
+    typer.echo(f"{len(items)} of {total} tracks")
+
+
+class _LineStream:
+    """Stands in for sys.stdout while the status line is shown, so lines the
+    pipeline prints appear above the status line instead of running into it"""
+
+    def __init__(self, summary: "ProgressSummary", stream: IO[str]) -> None:
+        self._summary = summary
+        self._stream = stream
+        self._pending = ""
+
+    def write(self, text: str) -> int:
+        self._pending += text
+        if "\n" in self._pending:
+            lines, _, self._pending = self._pending.rpartition("\n")
+            self._summary.print_above(lines)
+        return len(text)
+
+    def flush(self) -> None:
+        self._stream.flush()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+
+class ProgressSummary:
+    """Counts tracks per pipeline state and keeps a one-line summary of them on
+    stderr, redrawn in place while stderr is a terminal"""
+
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self.live = sys.stderr.isatty()
+        self._states: Dict[str, str] = {}
+        self._lock = threading.RLock()
+        self._started = time.monotonic()
+        self._drawn_at = 0.0
+        self._stdout: Optional[IO[str]] = None
+
+    def __enter__(self) -> "ProgressSummary":
+        if self.live and sys.stdout.isatty():
+            self._stdout = sys.stdout
+            sys.stdout = _LineStream(self, self._stdout)  # type: ignore[assignment]
+        self._draw(force=True)
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        with self._lock:
+            if self._stdout is not None:
+                sys.stdout = self._stdout
+                self._stdout = None
+            self._clear()
+        typer.echo(self.line(), err=True)
+
+    def set_state(self, track: str, state: str) -> None:
+        with self._lock:
+            self._states[track] = state
+            self._draw(force=state in FINISHED_STATES)
+
+    def finished(self) -> int:
+        with self._lock:
+            return sum(1 for state in self._states.values() if state in FINISHED_STATES)
+
+    def failed(self) -> int:
+        with self._lock:
+            return sum(1 for state in self._states.values() if state == "failed")
+
+    def line(self) -> str:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for state in self._states.values():
+                counts[state] = counts.get(state, 0) + 1
+        elapsed = time.monotonic() - self._started
+        finished = counts.get("done", 0) + counts.get("failed", 0)
+        active = ", ".join(f"{counts[s]} {s}" for s in sorted(counts) if s not in FINISHED_STATES)
+        parts = [f"[{finished}/{self.total}] {counts.get('done', 0)} done, {counts.get('failed', 0)} failed"]
+        if active:
+            parts.append(active)
+        parts.append(f"{finished / elapsed if elapsed else 0:.2f} tracks/s, {elapsed:.0f}s")
+        return " | ".join(parts)
+
+    def print_above(self, text: str) -> None:
+        """Print text (without trailing newline) above the status line"""
+        with self._lock:
+            self._clear()
+            stream = self._stdout or sys.stdout
+            stream.write(text + "\n")
+            stream.flush()
+            self._draw(force=True)
+
+    def echo(self, text: str) -> None:
+        if self._stdout is not None:
+            self.print_above(text)
+        else:
+            typer.echo(text)
+
+    def _clear(self) -> None:
+        if self.live:
+            sys.stderr.write("\r\033[K")
+
+    def _draw(self, force: bool = False) -> None:
+        if not self.live:
+            return
+        now = time.monotonic()
+        if not force and now - self._drawn_at < STATUS_INTERVAL:
+            return
+        self._drawn_at = now
+        sys.stderr.write("\r\033[K" + self.line())
+        sys.stderr.flush()
+
+
+def run_local(
+    urls: List[str],
+    batch: bool,
+    jobs: Optional[int],
+    audio_format: str,
+    start: Optional[str],
+    end: Optional[str],
+    loudness: Optional[str],
+) -> int:
+    """Download in this process; returns the number of failed tracks"""
+    from core.downloader import (
+        configure_logging,
+        download_audio,
+        download_batch,
+        download_many,
+        parse_timestamp,
+        BATCH_CONCURRENCY,
+    )
+
+    configure_logging()
+    concurrency = jobs or BATCH_CONCURRENCY
+    clip_start = parse_timestamp(start)
+    clip_end = parse_timestamp(end)
+
+    if batch:
+        failed = 0
+        for url in urls:
+            platform = identify_platform(url)
+            typer.echo(f"Detected platform: {platform}")
+
+            def on_track(index: int, result: Dict[str, Any]) -> None:
+                if result["status"] == "success":
+                    typer.echo(f"[{index + 1}] ✅ {result['title'] or result['url']}")
+                else:
+                    typer.echo(f"[{index + 1}] ❌ {result['title'] or result['url']}: {result['reason']}")
+
+            results = download_batch(
+                url,
+                platform=platform,
+                concurrency=concurrency,
+                audio_format=audio_format,
+                on_track=on_track,
+                loudness=loudness,
+            )
+            batch_failed = sum(1 for r in results if r["status"] != "success")
+            typer.echo(f"Batch finished: {len(results) - batch_failed}/{len(results)} tracks downloaded")
+            failed += batch_failed
+        return failed
+
+    if len(urls) == 1:
+        url = urls[0]
         platform = identify_platform(url)
         typer.echo(f"Detected platform: {platform}")
-        
+
         # Generate unique request ID for this CLI session
         request_id = f"cli_{str(hash(url))[:8]}"
-        
-        download_audio(url, platform=platform, request_id=request_id)
+
+        download_audio(
+            url,
+            platform=platform,
+            request_id=request_id,
+            audio_format=audio_format,
+            start=clip_start,
+            end=clip_end,
+            loudness=loudness,
+        )
+        return 0
+
+    # Many URLs: one pipeline for all of them, `concurrency` downloads at a time
+    with ProgressSummary(len(urls)) as summary:
+        def on_stage(index: int, stage: str) -> None:
+            summary.set_state(urls[index], stage)
+
+        def on_result(index: int, result: Dict[str, Any]) -> None:
+            if result["status"] != "success":
+                summary.echo(f"❌ {result['url']}: {result['reason']}")
+            summary.set_state(result["url"], "done" if result["status"] == "success" else "failed")
+
+        for url in urls:
+            summary.set_state(url, "queued")
+        download_many(
+            [{"url": url, "title": None} for url in urls],
+            concurrency=concurrency,
+            audio_format=audio_format,
+            on_track=on_result,
+            loudness=loudness,
+            on_stage=on_stage,
+            id_prefix="cli",
+        )
+    return summary.failed()
+
+def server_request(server: str, path: str, payload: Optional[Dict[str, Any]] = None, timeout: float = 30) -> Any:
+    """GET (or POST payload as JSON to) a spotifytool-server endpoint and decode the JSON reply"""
+    import urllib.error
+    import urllib.request
+
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    request = urllib.request.Request(
+        server.rstrip("/") + path, data=data, headers={"Content-Type": "application/json"} if data else {}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        if e.code == 404:
+            return None
+        raise RuntimeError(f"{server}{path} returned HTTP {e.code}")
+    except urllib.error.URLError as e:
+        raise RuntimeError(f"Can't reach spotifytool-server at {server}: {e.reason}")
+
+def run_remote(
+    server: str,
+    urls: List[str],
+    batch: bool,
+    audio_format: str,
+    start: Optional[str],
+    end: Optional[str],
+    loudness: Optional[str],
+) -> int:
+    """Queue the downloads on a running server and follow them until they finish;
+    returns the number of failed tracks. The server's own worker count applies."""
+    server_request(server, "/health", timeout=5)
+    job_ids: List[str] = []
+    rejected = 0
+    for url in urls:
+        if batch:
+            payload: Dict[str, Any] = {"url": url, "audio_format": audio_format, "loudness": loudness}
+            reply = server_request(server, "/download/batch", payload, timeout=300)
+        else:
+            payload = {"url": url, "audio_format": audio_format, "start": start, "end": end, "loudness": loudness}
+            reply = server_request(server, "/download", payload)
+        if not reply or reply.get("status") != "queued":
+            typer.echo(f"❌ {url}: {(reply or {}).get('reason', 'rejected by the server')}")
+            rejected += 1
+        elif batch:
+            typer.echo(f"📃 {reply['title'] or url}: {len(reply['job_ids'])} tracks")
+            job_ids += reply["job_ids"]
+        else:
+            job_ids.append(reply["job_id"])
+    # Duplicate requests attach to the same job
+    job_ids = list(dict.fromkeys(job_ids))
+    if not job_ids:
+        return rejected
+
+    with ProgressSummary(len(job_ids)) as summary:
+        unfinished = set(job_ids)
+        while unfinished:
+            jobs = {job["id"]: job for job in server_request(server, "/jobs")["jobs"]}
+            for job_id in list(unfinished):
+                # Finished jobs drop out of /jobs once the server's history is full
+                job = jobs.get(job_id) or server_request(server, f"/jobs/{job_id}")
+                if job is None:
+                    job = {"state": "failed", "url": job_id, "error": "no longer tracked by the server"}
+                summary.set_state(job_id, job["state"])
+                if job["state"] in FINISHED_STATES:
+                    unfinished.discard(job_id)
+                    if job["state"] == "done":
+                        summary.echo(f"✅ {job.get('title') or job['url']}: {job.get('result')}")
+                    else:
+                        summary.echo(f"❌ {job['url']}: {job.get('error')}")
+            if unfinished:
+                time.sleep(SERVER_POLL_INTERVAL)
+    return rejected + summary.failed()
+
+@app.command()
+def main(
+    urls: Optional[List[str]] = typer.Argument(
+        None, help="YouTube or SoundCloud URLs; - reads them from stdin, one per line"
+    ),
+    input_file: Optional[str] = typer.Option(
+        None, "--input", "-i", help="Read URLs from this file, one per line (- for stdin)"
+    ),
+    batch: bool = typer.Option(False, "--batch", help="Download every track of a playlist or set"),
+    jobs: Optional[int] = typer.Option(
+        None, "--jobs", "-j", "--concurrency",
+        help="Tracks downloaded at once (default: SPOTIFYTOOL_BATCH_CONCURRENCY, 3)",
+    ),
+    audio_format: str = typer.Option(
+        "mp3", "--format", help="Output format (mp3, opus, m4a); opus/m4a keep the native stream without re-encoding"
+    ),
+    start: Optional[str] = typer.Option(None, "--start", help="Only download from this time (seconds or [HH:]MM:SS)"),
+    end: Optional[str] = typer.Option(None, "--end", help="Only download up to this time (seconds or [HH:]MM:SS)"),
+    loudness: Optional[str] = typer.Option(
+        None, "--loudness",
+        help="off, tag (measure and write ReplayGain tags) or apply (normalize the audio); default: SPOTIFYTOOL_LOUDNESS",
+    ),
+    server: Optional[str] = typer.Option(
+        None, "--server", envvar="SPOTIFYTOOL_SERVER",
+        help="Queue the downloads on the spotifytool-server at this URL (e.g. http://127.0.0.1:5000) instead of downloading here",
+    ),
+    list_library: bool = typer.Option(False, "--list", help="List downloaded tracks, newest first"),
+    search: Optional[str] = typer.Option(None, "--search", help="Search downloaded tracks by title or artist"),
+    limit: int = typer.Option(50, "--limit", help="Maximum tracks shown by --list/--search"),
+) -> None:
+    try:
+        if list_library or search:
+            print_library(search, limit)
+            return
+        targets = read_urls(urls or [], input_file)
+        if not targets:
+            raise ValueError("Give URLs to download (arguments, --input or stdin), or --list/--search to browse the library")
+        if (start or end) and (batch or len(targets) > 1):
+            raise ValueError("--start/--end apply to a single track, not a --batch download or several URLs")
+
+        if server:
+            failed = run_remote(server, targets, batch, audio_format, start, end, loudness)
+        else:
+            failed = run_local(targets, batch, jobs, audio_format, start, end, loudness)
+        if failed:
+            raise typer.Exit(1)
+    except typer.Exit:
+        raise
     except Exception as e:
         typer.echo(f"Error: {e}")
         raise typer.Exit(1)
 
 if __name__ == "__main__":
-    app()
\ No newline at end of file
+    app()
@@ -1,27 +1,186 @@
 import subprocess
 import json
+import time
+import threading
+import base64
+import hashlib
+import struct
 import os
 import shutil
 import logging
+import math
+import uuid
 from pathlib import Path
 from datetime import datetime
 import re
-from typing import Dict, Optional, Any, Union
-
-# Configure logging to write to the same file as server
-logging.basicConfig(
-    filename="/tmp/spotifytool-server.log",
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s %(message)s",
-    force=True  # Override any existing config
+from typing import Callable, Dict, Iterable, List, Optional, Any, Union
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from core.cache import DownloadCache, InfoCache, LibraryIndex
+from core.ytdlp_pool import YtdlpPool, ytdlp_available
+from core.storage import StorageManager
+from core.retry import RateLimiter, PermanentDownloadError, classify_error, backoff_delay, PERMANENT
+from core.loudness import (
+    LOUDNESS_OFF,
+    LOUDNESS_TAG,
+    LOUDNESS_APPLY,
+    check_loudness_mode,
+    analysis_output_args,
+    normalize_filter_args,
+    parse_loudness,
+    replaygain_db,
+    replaygain_tag_args,
+)
+from core.metrics import (
+    metrics,
+    STAGE_METADATA,
+    STAGE_DOWNLOAD,
+    STAGE_THUMBNAIL,
+    STAGE_ENCODE_TAG,
+    STAGE_LOUDNESS,
+    STAGE_CLEANUP,
+    STAGE_TOTAL,
+    BYTES_DOWNLOADED,
+    BYTES_WRITTEN,
+    DOWNLOAD_RETRIES,
+    CACHE_HITS,
+    METADATA_CACHE_HITS,
 )
 
-# Find yt-dlp, ffmpeg, and scdl in PATH
+# The CLI and the server log to the same file
+LOG_FILE: str = "/tmp/spotifytool-server.log"
+
+# Find yt-dlp and ffmpeg in PATH
 YTDLP_PATH: str = shutil.which("yt-dlp") or "yt-dlp"
 FFMPEG_PATH: str = shutil.which("ffmpeg") or "ffmpeg"
-SCDL_PATH: str = shutil.which("scdl") or "scdl"
+
+# Extraction and downloads run on warm in-process yt-dlp workers when the yt_dlp
+# package is importable; "subprocess" runs the CLI at YTDLP_PATH for every call instead
+YTDLP_MODE: str = os.environ.get("SPOTIFYTOOL_YTDLP_MODE", "inprocess" if ytdlp_available() else "subprocess")
+ytdlp_pool: YtdlpPool = YtdlpPool(
+    max_idle=int(os.environ.get("SPOTIFYTOOL_YTDLP_IDLE", "8")),
+    max_jobs=int(os.environ.get("SPOTIFYTOOL_YTDLP_MAX_JOBS", "50")),
+)
 
 DOWNLOAD_DIR: Path = Path.home() / "Documents" / "Spotify"
+# Raw downloads and intermediate files go here (e.g. a tmpfs); only finished
+# files are written to DOWNLOAD_DIR, and renamed into place atomically
+SCRATCH_DIR: Path = Path(os.environ.get("SPOTIFYTOOL_SCRATCH_DIR") or DOWNLOAD_DIR)
+
+# Output formats and the yt-dlp format selector used to fetch each one.
+# opus/m4a prefer YouTube's native stream so the encode stage can stream-copy it
+OUTPUT_FORMATS: Dict[str, str] = {
+    "mp3": "bestaudio/best",
+    "opus": "bestaudio[acodec=opus]/bestaudio",
+    "m4a": "bestaudio[ext=m4a]/bestaudio",
+}
+# SoundCloud serves progressive/HLS MP3 and HLS Opus/AAC; pick the stream that
+# already matches the output so the encode stage copies it instead of re-encoding
+SOUNDCLOUD_FORMATS: Dict[str, str] = {
+    "mp3": "bestaudio[ext=mp3]/bestaudio",
+    "opus": "bestaudio[ext=opus]/bestaudio",
+    "m4a": "bestaudio[ext=m4a]/bestaudio",
+}
+PLATFORMS: tuple[str, ...] = ("youtube", "soundcloud")
+# Source extensions that already carry the target codec and can be copied as-is
+PASSTHROUGH_SUFFIXES: Dict[str, tuple[str, ...]] = {
+    "mp3": (".mp3",),
+    "opus": (".webm", ".opus", ".ogg"),
+    "m4a": (".m4a", ".mp4"),
+}
+# Temp files next to the downloaded audio that are not the audio itself
+NON_AUDIO_SUFFIXES: tuple[str, ...] = (".json", ".jpg", ".webp", ".png", ".part", ".ytdl", ".ffmeta")
+# Names of the temp files a download leaves in SCRATCH_DIR and DOWNLOAD_DIR, by request ID
+TEMP_FILE_PATTERNS: tuple[str, ...] = ("temp_audio_{id}.*", "thumbnail_{id}.*", ".encode_{id}.*")
+# Assumed audio bitrate (320 kbps) when yt-dlp doesn't know a stream's size
+ESTIMATED_BYTES_PER_SECOND: int = 40_000
+
+# Encode stage: CPU-bound ffmpeg work runs on its own pool sized to the machine,
+# separate from the network-bound download workers
+ENCODE_WORKERS: int = int(os.environ.get("SPOTIFYTOOL_ENCODE_WORKERS", str(os.cpu_count() or 2)))
+ENCODE_THREADS: int = int(os.environ.get("SPOTIFYTOOL_ENCODE_THREADS", "1"))
+MP3_QUALITY: str = os.environ.get("SPOTIFYTOOL_MP3_QUALITY", "5")  # LAME VBR quality, 0 (best) - 9
+ENCODE_TIMEOUT: int = 300  # 5 minute timeout for encoding/tagging, raised to realtime for long sources (see encode_timeout)
+ENCODER_ARGS: Dict[str, list[str]] = {
+    "mp3": ["-c:a", "libmp3lame", "-q:a", MP3_QUALITY],
+    "opus": ["-c:a", "libopus", "-b:a", "160k"],
+    "m4a": ["-c:a", "aac", "-b:a", "192k"],
+}
+encode_pool: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="encode")
+DEFAULT_FORMAT: str = "mp3"
+
+# Loudness handling when a request doesn't choose: "off", "tag" (measure during the
+# encode pass and write ReplayGain tags) or "apply" (normalize to LOUDNESS_TARGET LUFS)
+LOUDNESS_MODE: str = os.environ.get("SPOTIFYTOOL_LOUDNESS", "off")
+LOUDNESS_TARGET: float = float(os.environ.get("SPOTIFYTOOL_LOUDNESS_TARGET", "-14"))
+
+# Number of playlist tracks downloaded at once in batch mode
+BATCH_CONCURRENCY: int = int(os.environ.get("SPOTIFYTOOL_BATCH_CONCURRENCY", "3"))
+
+# Download retries: transient failures wait an exponential, jittered delay and
+# move one step down the player-client ladder; permanent ones fail right away
+DOWNLOAD_ATTEMPTS: int = int(os.environ.get("SPOTIFYTOOL_DOWNLOAD_ATTEMPTS", "4"))
+RETRY_BASE_DELAY: float = float(os.environ.get("SPOTIFYTOOL_RETRY_DELAY", "2"))
+RETRY_MAX_DELAY: float = float(os.environ.get("SPOTIFYTOOL_RETRY_MAX_DELAY", "60"))
+# YouTube player clients per attempt, ";"-separated; the first is also used for extraction
+PLAYER_CLIENT_LADDER: List[str] = os.environ.get(
+    "SPOTIFYTOOL_PLAYER_CLIENTS", "android,web;android_music,android,web;ios,mweb;tv,web_safari"
+).split(";")
+# Requests per second each platform gets across all workers, with short bursts allowed
+rate_limiter: RateLimiter = RateLimiter(
+    rate=float(os.environ.get("SPOTIFYTOOL_RATE_LIMIT", "2")),
+    burst=float(os.environ.get("SPOTIFYTOOL_RATE_BURST", "5")),
+)
+
+# Index of finished downloads keyed by canonical track ID
+download_cache: DownloadCache = DownloadCache(DOWNLOAD_DIR / ".spotifytool.sqlite3")
+
+# Extracted info is cached per canonical track ID. Titles and uploaders stay valid for
+# a long time, but the stream URLs inside expire after a few hours, so downloads only
+# reuse recent extractions made with their own player clients. Entries older than
+# METADATA_TTL are deleted
+METADATA_TTL: float = float(os.environ.get("SPOTIFYTOOL_METADATA_TTL", str(7 * 24 * 3600)))
+INFO_TTL: float = float(os.environ.get("SPOTIFYTOOL_INFO_TTL", "3600"))
+info_cache: InfoCache = InfoCache(
+    DOWNLOAD_DIR / ".spotifytool.sqlite3",
+    memory_size=int(os.environ.get("SPOTIFYTOOL_METADATA_MEMORY", "64")),
+    ttl=METADATA_TTL,
+)
+
+# Every finished file, for listing/searching and collision-free filenames
+library: LibraryIndex = LibraryIndex(DOWNLOAD_DIR / ".spotifytool.sqlite3")
+
+# Free space kept on both disks, and the scratch space concurrent downloads may hold at once
+storage: StorageManager = StorageManager(
+    DOWNLOAD_DIR,
+    SCRATCH_DIR,
+    min_free=int(os.environ.get("SPOTIFYTOOL_MIN_FREE_MB", "500")) * 2**20,
+    scratch_quota=int(os.environ.get("SPOTIFYTOOL_SCRATCH_QUOTA_MB", "2048")) * 2**20,
+)
+
+# Progress events passed to on_progress: stage, percent, and whatever
+# throughput numbers the tool reports (bytes, speed, eta)
+ProgressCallback = Callable[[Dict[str, Any]], None]
+
+# yt-dlp prints one machine-readable line per progress update with this template
+YTDLP_PROGRESS_PREFIX = "[progress]"
+YTDLP_PROGRESS_ARGS: list[str] = [
+    '--newline',
+    '--progress-template',
+    f"download:{YTDLP_PROGRESS_PREFIX} %(progress.downloaded_bytes)s "
+    "%(progress.total_bytes,progress.total_bytes_estimate)s %(progress.speed)s %(progress.eta)s",
+]
+
+# Stages reported through download_audio's on_stage callback
+STAGE_FETCHING_METADATA = "fetching_metadata"
+STAGE_DOWNLOADING = "downloading"
+STAGE_POST_PROCESSING = "post_processing"
+
+def configure_logging() -> None:
+    """Send log records to LOG_FILE. Entry points call this; importing the module
+    leaves logging alone, so callers that set up their own handlers keep them"""
+    logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
 def clean_youtube_url(url: str) -> str:
     """Clean YouTube URL by removing playlist and other problematic parameters"""
@@ -40,28 +199,131 @@ def clean_youtube_url(url: str) -> str:
     
     return url  # Return original URL if not YouTube or already clean
 
-def get_metadata_from_url(url: str) -> Dict[str, Optional[str]]:
+def cache_key(
+    url: str,
+    audio_format: str = DEFAULT_FORMAT,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    loudness: Optional[str] = None,
+) -> str:
+    """Key for the download cache and in-flight dedup; each output format, clip and
+    normalized copy is cached separately (ReplayGain tags don't change the audio)"""
+    key = canonical_id(url)
+    if audio_format != DEFAULT_FORMAT:
+        key = f"{key}#{audio_format}"
+    if start is not None or end is not None:
+        key = f"{key}@{start or 0:g}-{'' if end is None else f'{end:g}'}"
+    if (loudness or LOUDNESS_MODE) == LOUDNESS_APPLY:
+        key = f"{key}~normalized"
+    return key
+
+def parse_timestamp(value: Union[str, float, None]) -> Optional[float]:
+    """Parse seconds given as a number, "90", "1:30" or "1:02:03"; None/empty means unset"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        try:
+            seconds = 0.0
+            for part in value.strip().split(":"):
+                seconds = seconds * 60 + float(part)
+        except ValueError:
+            raise ValueError(f"Invalid timestamp '{value}', use seconds or [HH:]MM:SS")
+    if not math.isfinite(seconds):
+        raise ValueError(f"Invalid timestamp '{value}', use seconds or [HH:]MM:SS")
+    if seconds < 0:
+        raise ValueError(f"Invalid timestamp '{value}', must not be negative")
+    return seconds
+
+def format_timestamp(seconds: float) -> str:
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes}:{secs:02d}"
+
+def filename_timestamp(seconds: float) -> str:
+    # Like format_timestamp, without the colons that are forbidden in filenames
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{secs:02d}s" if hours else f"{minutes}m{secs:02d}s"
+
+def check_clip(start: Optional[float], end: Optional[float]) -> None:
+    if start is not None and end is not None and end <= start:
+        raise ValueError(f"Clip end ({format_timestamp(end)}) must be after its start ({format_timestamp(start)})")
+
+def canonical_id(url: str) -> str:
+    """Resolve a URL to a stable platform:id key, ignoring playlist, timestamp and tracking params"""
+    import urllib.parse as urlparse
+
+    parsed = urlparse.urlparse(clean_youtube_url(url))
+    netloc = parsed.netloc.lower()
+    path_parts = [p for p in parsed.path.split('/') if p]
+    if 'youtube.com' in netloc:
+        video_id = urlparse.parse_qs(parsed.query).get('v', [None])[0]
+        if not video_id and len(path_parts) >= 2 and path_parts[0] in ('shorts', 'embed', 'live', 'v'):
+            video_id = path_parts[1]
+        if video_id:
+            return f"youtube:{video_id}"
+    elif 'youtu.be' in netloc and path_parts:
+        return f"youtube:{path_parts[0]}"
+    elif 'soundcloud.com' in netloc and len(path_parts) >= 2:
+        # soundcloud.com/<artist>/<track>, slugs are case-insensitive
+        return f"soundcloud:{path_parts[0].lower()}/{path_parts[1].lower()}"
+    return url
+
+def url_platform(url: str) -> str:
+    """Platform name used for rate limiting ("youtube", "soundcloud" or "other")"""
+    key = canonical_id(url)
+    return key.split(":", 1)[0] if key != url else "other"
+
+def error_summary(stderr: Optional[str]) -> str:
+    """The last ERROR line yt-dlp printed, for user-facing messages"""
+    lines = [line.strip() for line in (stderr or "").splitlines() if line.strip()]
+    errors = [line for line in lines if line.startswith("ERROR:")]
+    return (errors or lines or ["unknown error"])[-1]
+
+def fetch_info(url: str, extra_args: Optional[list[str]] = None, max_age: float = METADATA_TTL) -> Dict[str, Any]:
+    """Return the full yt-dlp info JSON, from the cache if it is at most max_age seconds old.
+
+    When extra_args is given (a download's player clients), only an extraction
+    made with the same arguments is reused, so its stream URLs are valid for them.
+    Without it any cached extraction will do, and a miss extracts with the first
+    download attempt's player clients so the download can reuse the entry.
+    """
+    key = canonical_id(url)
+    extractor = " ".join(extra_args or [])
+    cached = info_cache.get(key, max_age, extractor if extra_args is not None else None)
+    if cached is not None:
+        logging.info(f"Metadata cache hit for {key}")
+        metrics.inc(METADATA_CACHE_HITS)
+        return cached
+    if extra_args is None:
+        extra_args = extractor_args(url_platform(url), 0)
+        extractor = " ".join(extra_args)
+
     # Clean the URL first to avoid playlist issues
     clean_url = clean_youtube_url(url)
     if clean_url != url:
         logging.info(f"Cleaned URL from {url} to {clean_url}")
     
     # Use yt-dlp to get all metadata in one call with timeout
-    cmd: list[str] = [YTDLP_PATH, '--quiet', '--skip-download', '--dump-json', '--socket-timeout', '30', clean_url]
+    args: list[str] = ['--socket-timeout', '30'] + (extra_args or [])
+    cmd: list[str] = [YTDLP_PATH, '--quiet', '--skip-download', '--dump-json'] + args + [clean_url]
+    rate_limiter.acquire(url_platform(clean_url))
     try:
-        result: subprocess.CompletedProcess = subprocess.run(
-            cmd,
-            check=True,
-            capture_output=True,
-            text=True,
-            timeout=45  # 45 second timeout for metadata fetch
-        )
-        data: Dict[str, Any] = json.loads(result.stdout)
-        return {
-            "title": data.get("title"),
-            "uploader": data.get("uploader"),
-            "release_date": data.get("release_date")  # Format: YYYYMMDD or None
-        }
+        if YTDLP_MODE == "inprocess":
+            info: Dict[str, Any] = ytdlp_pool.extract(args, clean_url, timeout=45)
+        else:
+            result: subprocess.CompletedProcess = subprocess.run(
+                cmd,
+                check=True,
+                capture_output=True,
+                text=True,
+                timeout=45  # 45 second timeout for metadata fetch
+            )
+            info = json.loads(result.stdout)
+        info_cache.put(key, info, extractor)
+        return info
     except subprocess.TimeoutExpired:
         logging.error(f"yt-dlp metadata fetch timed out for {clean_url}")
         raise RuntimeError(f"Metadata fetch timed out. The URL might be invalid or inaccessible.")
@@ -71,7 +333,9 @@ def get_metadata_from_url(url: str) -> Dict[str, Optional[str]]:
             logging.error(f"yt-dlp stderr: {e.stderr}")
         if e.stdout:
             logging.error(f"yt-dlp stdout: {e.stdout}")
-        raise RuntimeError(f"Failed to get metadata: Video might be private, deleted, or URL is invalid (error code {e.returncode})")
+        if classify_error(e.stderr) == PERMANENT:
+            raise PermanentDownloadError(f"Video is unavailable: {error_summary(e.stderr)}")
+        raise RuntimeError(f"Failed to get metadata (error code {e.returncode}): {error_summary(e.stderr)}")
     except json.JSONDecodeError as e:
         logging.error(f"Failed to parse yt-dlp JSON output for {clean_url}: {e}")
         raise RuntimeError(f"Invalid response from video platform for {clean_url}")
@@ -79,6 +343,304 @@ def get_metadata_from_url(url: str) -> Dict[str, Optional[str]]:
         logging.error(f"Unexpected error getting metadata for {clean_url}: {e}")
         raise RuntimeError(f"Unexpected error getting metadata: {e}")
 
+def metadata_from_info(data: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    return {
+        "title": data.get("title"),
+        "uploader": data.get("uploader"),
+        "release_date": data.get("release_date")  # Format: YYYYMMDD or None
+    }
+
+def get_metadata_from_url(url: str) -> Dict[str, Optional[str]]:
+    return metadata_from_info(fetch_info(url))
+
+def prefetch_metadata(urls: List[str]) -> Dict[str, Optional[Dict[str, Optional[str]]]]:
+    """Resolve metadata for many URLs at once.
+
+    Cached entries are answered directly; the rest are extracted by a single
+    yt-dlp process reading the URLs from stdin, so interpreter startup and
+    extractor imports are paid once per call rather than once per URL.
+    Extractions use the first download attempt's player clients, so a later
+    download reuses them. URLs that fail to resolve map to None.
+    """
+    results: Dict[str, Optional[Dict[str, Optional[str]]]] = {}
+    missing: Dict[str, List[str]] = {}
+    for url in urls:
+        key = canonical_id(url)
+        cached = info_cache.get(key, METADATA_TTL)
+        if cached is not None:
+            metrics.inc(METADATA_CACHE_HITS)
+            results[url] = metadata_from_info(cached)
+        else:
+            missing.setdefault(key, []).append(url)
+
+    timeout = 45 + 10 * len(missing)
+    if missing and YTDLP_MODE == "inprocess":
+        # One warm worker resolves them all in turn, within the same overall deadline as the batch process
+        logging.info(f"Prefetching metadata for {len(missing)} URLs ({len(urls) - len(missing)} cached)")
+        deadline = time.monotonic() + timeout
+        for key, group in missing.items():
+            rate_limiter.acquire(url_platform(group[0]))
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise subprocess.TimeoutExpired("yt-dlp", timeout)
+                args = ['--socket-timeout', '30'] + extractor_args(url_platform(group[0]), 0)
+                info = ytdlp_pool.extract(args, clean_youtube_url(group[0]), timeout=remaining)
+            except subprocess.TimeoutExpired:
+                logging.error(f"yt-dlp metadata prefetch timed out after {timeout}s, keeping partial results")
+                break
+            except subprocess.CalledProcessError as e:
+                logging.warning(f"Metadata prefetch failed for {group[0]}: {e.stderr}")
+                continue
+            info_cache.put(key, info, " ".join(extractor_args(url_platform(group[0]), 0)))
+            for url in group:
+                results[url] = metadata_from_info(info)
+    elif missing:
+        cmd: list[str] = [
+            YTDLP_PATH, '--quiet', '--skip-download', '--dump-json', '--ignore-errors',
+            '--socket-timeout', '30', '--batch-file', '-'
+        ] + extractor_args("youtube", 0)  # Only applies to YouTube URLs
+        batch_input = "\n".join(clean_youtube_url(group[0]) for group in missing.values()) + "\n"
+        logging.info(f"Prefetching metadata for {len(missing)} URLs ({len(urls) - len(missing)} cached)")
+        for group in missing.values():
+            rate_limiter.acquire(url_platform(group[0]))
+        try:
+            # --ignore-errors keeps going past bad URLs but exits non-zero, so don't check
+            result = subprocess.run(cmd, input=batch_input, capture_output=True, text=True, timeout=timeout)
+            stdout = result.stdout
+            if result.returncode != 0 and result.stderr:
+                logging.warning(f"yt-dlp prefetch reported errors: {result.stderr[-500:]}")
+        except subprocess.TimeoutExpired as e:
+            logging.error(f"yt-dlp metadata prefetch timed out after {timeout}s, keeping partial results")
+            stdout = e.stdout.decode() if isinstance(e.stdout, bytes) else (e.stdout or "")
+
+        for line in stdout.splitlines():
+            try:
+                info: Dict[str, Any] = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            key = canonical_id(info.get("original_url") or info.get("webpage_url") or "")
+            if key not in missing:
+                continue
+            info_cache.put(key, info, " ".join(extractor_args(url_platform(missing[key][0]), 0)))
+            for url in missing[key]:
+                results[url] = metadata_from_info(info)
+
+    for url in urls:
+        results.setdefault(url, None)
+    return results
+
+def playlist_url(url: str) -> str:
+    """Turn a watch URL that carries a list= param into the playlist URL itself"""
+    import urllib.parse as urlparse
+
+    parsed = urlparse.urlparse(url)
+    if 'youtube.com' in parsed.netloc or 'youtu.be' in parsed.netloc:
+        list_id = urlparse.parse_qs(parsed.query).get('list', [None])[0]
+        if list_id:
+            return f"https://www.youtube.com/playlist?list={list_id}"
+    return url
+
+def expand_playlist(url: str) -> Dict[str, Any]:
+    """List the tracks of a playlist/set with a single flat extraction (no per-track requests)"""
+    list_url = playlist_url(url)
+    cmd: list[str] = [
+        YTDLP_PATH, '--quiet', '--flat-playlist', '--dump-single-json', '--socket-timeout', '30', list_url
+    ]
+    try:
+        result: subprocess.CompletedProcess = subprocess.run(
+            cmd,
+            check=True,
+            capture_output=True,
+            text=True,
+            timeout=120  # Large playlists are paged, allow more time than a single track
+        )
+        data: Dict[str, Any] = json.loads(result.stdout)
+    except subprocess.TimeoutExpired:
+        logging.error(f"yt-dlp playlist expansion timed out for {list_url}")
+        raise RuntimeError("Playlist expansion timed out. The URL might be invalid or inaccessible.")
+    except subprocess.CalledProcessError as e:
+        logging.error(f"yt-dlp playlist expansion failed for {list_url}: return code {e.returncode}")
+        if e.stderr:
+            logging.error(f"yt-dlp stderr: {e.stderr}")
+        raise RuntimeError(f"Failed to expand playlist: it might be private, deleted, or the URL is invalid (error code {e.returncode})")
+    except json.JSONDecodeError as e:
+        logging.error(f"Failed to parse yt-dlp JSON output for {list_url}: {e}")
+        raise RuntimeError(f"Invalid response from video platform for {list_url}")
+
+    # A single track URL comes back without entries, treat it as a one-track batch
+    raw_entries = data.get("entries")
+    if raw_entries is None:
+        raw_entries = [data]
+
+    entries: List[Dict[str, Optional[str]]] = []
+    for entry in raw_entries:
+        if not entry:
+            continue  # Unavailable tracks show up as null entries
+        track_url = entry.get("webpage_url") or entry.get("url")
+        if not track_url:
+            continue
+        entries.append({"url": track_url, "title": entry.get("title")})
+
+    logging.info(f"Expanded playlist {list_url}: {len(entries)} tracks")
+    return {"title": data.get("title"), "url": list_url, "entries": entries}
+
+def format_selector(platform: str, audio_format: str) -> str:
+    if platform == "soundcloud":
+        return SOUNDCLOUD_FORMATS[audio_format]
+    return OUTPUT_FORMATS[audio_format]
+
+def retry_pause(attempt: int, stats: Dict[str, float], unique_id: str) -> None:
+    """Count a retry of a failed yt-dlp call and sleep with backoff before it"""
+    delay = backoff_delay(attempt, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+    metrics.inc(DOWNLOAD_RETRIES)
+    stats["retries"] = stats.get("retries", 0) + 1
+    logging.info(f"[{unique_id}] Retrying in {delay:.1f}s")
+    time.sleep(delay)
+
+def extractor_args(platform: str, attempt: int) -> list[str]:
+    """YouTube player clients for a download attempt, walking down the ladder on retries"""
+    if platform != "youtube":
+        return []
+    clients = PLAYER_CLIENT_LADDER[attempt % len(PLAYER_CLIENT_LADDER)]
+    return ['--extractor-args', f'youtube:player_client={clients}']
+
+def run_streaming(
+    cmd: list[str],
+    timeout: float,
+    on_line: Optional[Callable[[str], None]] = None,
+    cwd: Optional[str] = None,
+) -> subprocess.CompletedProcess:
+    """Like subprocess.run(check=True, capture_output=True, text=True), but hands
+    each stdout line to on_line as it arrives instead of buffering until exit"""
+    proc = subprocess.Popen(
+        cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        cwd=cwd,
+    )
+    stderr_chunks: list[str] = []
+    stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()), daemon=True)
+    stderr_reader.start()
+    timed_out = threading.Event()
+
+    def kill() -> None:
+        timed_out.set()
+        proc.kill()
+
+    watchdog = threading.Timer(timeout, kill)
+    watchdog.start()
+    stdout_lines: list[str] = []
+    try:
+        for line in proc.stdout:
+            stdout_lines.append(line)
+            if on_line:
+                try:
+                    on_line(line.rstrip("\n"))
+                except Exception as e:
+                    logging.warning(f"Progress callback failed: {e}")
+        proc.wait()
+    finally:
+        watchdog.cancel()
+        stderr_reader.join(timeout=5)
+
+    stdout = "".join(stdout_lines)
+    stderr = "".join(stderr_chunks)
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout, output=stdout, stderr=stderr)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+def _number(value: str) -> Optional[float]:
+    try:
+        return float(value)
+    except ValueError:
+        return None  # yt-dlp prints NA for unknown fields
+
+def ytdlp_progress_parser(on_progress: Optional[ProgressCallback]) -> Callable[[str], None]:
+    """Turn yt-dlp progress-template lines into progress events"""
+    def on_line(line: str) -> None:
+        if not on_progress or not line.startswith(YTDLP_PROGRESS_PREFIX):
+            return
+        parts = line[len(YTDLP_PROGRESS_PREFIX):].split()
+        if len(parts) != 4:
+            return
+        downloaded, total, speed, eta = (_number(p) for p in parts)
+        on_progress(download_progress_event(downloaded, total, speed, eta))
+    return on_line
+
+def download_progress_event(
+    downloaded: Optional[float], total: Optional[float], speed: Optional[float], eta: Optional[float]
+) -> Dict[str, Any]:
+    return {
+        "stage": STAGE_DOWNLOADING,
+        "percent": round(downloaded / total * 100, 1) if downloaded is not None and total else None,
+        "downloaded_bytes": downloaded,
+        "total_bytes": total,
+        "speed": speed,  # bytes/s
+        "eta": eta,  # seconds
+    }
+
+def run_ytdlp_download(
+    args: list[str],
+    outtmpl: str,
+    url: Optional[str] = None,
+    info_file: Optional[str] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    timeout: float = 300,
+) -> str:
+    """Download url (or a saved info JSON) with yt-dlp in the configured mode, returning its stdout"""
+    if YTDLP_MODE == "inprocess":
+        def hook(status: Dict[str, Any]) -> None:
+            if on_progress:
+                on_progress(download_progress_event(
+                    status.get("downloaded_bytes"),
+                    status.get("total_bytes") or status.get("total_bytes_estimate"),
+                    status.get("speed"),
+                    status.get("eta"),
+                ))
+        ytdlp_pool.download(args, outtmpl, url=url, info_file=info_file, on_progress=hook, timeout=timeout)
+        return ""
+    cmd = [YTDLP_PATH] + args + YTDLP_PROGRESS_ARGS + ['--output', outtmpl]
+    cmd += ['--load-info-json', info_file] if info_file else [url or ""]
+    result = run_streaming(
+        cmd,
+        timeout=timeout,
+        on_line=ytdlp_progress_parser(on_progress),
+        cwd=str(SCRATCH_DIR)  # Set working directory
+    )
+    return result.stdout
+
+def ffmpeg_progress_parser(on_progress: Optional[ProgressCallback], duration: Optional[float]) -> Callable[[str], None]:
+    """Turn ffmpeg -progress key=value blocks into progress events"""
+    block: Dict[str, str] = {}
+
+    def on_line(line: str) -> None:
+        if not on_progress or "=" not in line:
+            return
+        key, _, value = line.partition("=")
+        block[key.strip()] = value.strip()
+        if key != "progress":
+            return
+        out_time = _number(block.get("out_time_us", "")) if block.get("out_time_us") else None
+        seconds = out_time / 1_000_000 if out_time is not None else None
+        percent = None
+        if value.strip() == "end":
+            percent = 100.0
+        elif seconds is not None and duration:
+            percent = round(min(seconds / duration * 100, 100), 1)
+        on_progress({
+            "stage": STAGE_POST_PROCESSING,
+            "percent": percent,
+            "out_seconds": seconds,
+            "speed": block.get("speed"),  # e.g. "35.2x" realtime
+        })
+        block.clear()
+    return on_line
+
 def set_file_mtime(filepath: Union[str, Path], release_date: Optional[str]) -> None:
     if not release_date or len(release_date) != 8:
         return
@@ -86,307 +648,732 @@ def set_file_mtime(filepath: Union[str, Path], release_date: Optional[str]) -> N
     mod_time: float = dt.timestamp()
     os.utime(filepath, (mod_time, mod_time))
 
+def temp_dirs() -> list[Path]:
+    return [SCRATCH_DIR] if SCRATCH_DIR == DOWNLOAD_DIR else [SCRATCH_DIR, DOWNLOAD_DIR]
+
+def remove_temp_files(unique_id: str) -> None:
+    """Delete a download's temp files and give back its scratch space and filename claims"""
+    for directory in temp_dirs():
+        for pattern in TEMP_FILE_PATTERNS:
+            for leftover in directory.glob(pattern.format(id=unique_id)):
+                try:
+                    leftover.unlink()
+                except FileNotFoundError:
+                    pass
+    storage.release(unique_id)
+    library.release(unique_id)
+
+def estimate_size(info: Dict[str, Any], seconds: Optional[float]) -> int:
+    """Rough bytes a download will take: the largest audio-only stream, scaled to
+    the section being downloaded"""
+    full = info.get("duration")
+    sizes = [
+        f.get("filesize") or f.get("filesize_approx") or 0
+        for f in info.get("formats") or []
+        if f.get("vcodec") == "none"
+    ]
+    size = max(sizes, default=0)
+    if size and seconds and full:
+        return int(size * min(1.0, seconds / full))
+    return size or int((seconds or full or 600) * ESTIMATED_BYTES_PER_SECOND)
+
+def sweep_temp_files(keep: Iterable[str] = (), min_age: float = 900) -> int:
+    """Delete temp files left behind by downloads that will never finish
+    (crashes, failures), except those of the job IDs in keep. Files touched in
+    the last min_age seconds are left alone, since a CLI download may own them.
+    Returns the bytes freed."""
+    keep_prefixes = tuple(pattern.format(id=job_id)[:-1] for job_id in keep for pattern in TEMP_FILE_PATTERNS)
+    cutoff = time.time() - min_age
+    freed = 0
+    for pattern in TEMP_FILE_PATTERNS:
+        for leftover in (f for directory in temp_dirs() for f in directory.glob(pattern.format(id="*"))):
+            if leftover.name.startswith(keep_prefixes):
+                continue
+            try:
+                stat = leftover.stat()
+                if stat.st_mtime > cutoff:
+                    continue
+                size = stat.st_size
+                leftover.unlink()
+            except OSError as e:
+                logging.warning(f"Failed to remove orphaned temp file {leftover}: {e}")
+                continue
+            freed += size
+            logging.info(f"Removed orphaned temp file {leftover}")
+    return freed
+
+def file_sha1(path: Path) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 def sanitize_filename(name: str) -> str:
     # Replace / and \ and other forbidden characters with _
     return re.sub(r'[\\/:"*?<>|]+', '_', name)
 
-def download_audio(url: str, title: Optional[str] = None, platform: str = "youtube", request_id: Optional[str] = None) -> None:
-    import time
-    start_time = time.time()
+def _opus_cover_metadata(cover: Path, scratch: Path, unique_id: str) -> Path:
+    """Write an ffmetadata file carrying the cover as a METADATA_BLOCK_PICTURE comment.
+
+    Ogg has no attached-picture streams, so Opus players read cover art from
+    this base64-encoded FLAC picture block instead.
+    """
+    jpeg = cover
+    if cover.suffix != ".jpg":
+        jpeg = scratch.with_suffix(".cover.jpg")
+        with metrics.timed(STAGE_THUMBNAIL):
+            subprocess.run(
+                [FFMPEG_PATH, "-y", "-i", str(cover), str(jpeg)],
+                check=True,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=30,
+            )
+    data = jpeg.read_bytes()
+    mime = b"image/jpeg"
+    # Picture type 3 (front cover), mime, empty description, unknown dimensions
+    block = (
+        struct.pack(">II", 3, len(mime)) + mime
+        + struct.pack(">I", 0)
+        + struct.pack(">IIIII", 0, 0, 0, 0, len(data)) + data
+    )
+    encoded = base64.b64encode(block).decode("ascii").replace("=", "\\=")
+    meta_file = scratch.with_suffix(".ffmeta")
+    meta_file.write_text(f";FFMETADATA1\nMETADATA_BLOCK_PICTURE={encoded}\n")
+    logging.info(f"[{unique_id}] Prepared Opus cover metadata: {meta_file}")
+    return meta_file
+
+def encode_timeout(duration: Optional[float]) -> float:
+    """ENCODE_TIMEOUT, or the audio's duration if longer: multi-hour sources (more so
+    through loudnorm) can take more than 5 minutes but never slower than realtime"""
+    return max(ENCODE_TIMEOUT, duration or 0)
+
+def audio_codec_args(source: Path, audio_format: str, filtered: bool = False) -> list[str]:
+    """Stream copy when the source already has the target codec, otherwise encode.
+    Filtered audio (e.g. normalized) always has to be encoded."""
+    if source.suffix in PASSTHROUGH_SUFFIXES[audio_format] and not filtered:
+        return ["-c:a", "copy"]
+    return ENCODER_ARGS[audio_format] + ["-threads", str(ENCODE_THREADS)]
+
+def encode_and_tag(
+    source: Path,
+    dest: Path,
+    title: Optional[str],
+    artist: Optional[str],
+    release_date: Optional[str],
+    cover: Optional[Path],
+    unique_id: str,
+    on_progress: Optional[ProgressCallback] = None,
+    duration: Optional[float] = None,
+    loudness: str = LOUDNESS_OFF,
+    known_loudness: Optional[Dict[str, float]] = None,
+) -> Optional[Dict[str, float]]:
+    """Encode (or copy) the audio from source to dest, adding tags and cover art in one ffmpeg pass.
+
+    The output format is taken from dest's extension. With loudness "tag" the same
+    pass measures the audio (unless known_loudness already has the numbers, which
+    are then written as ReplayGain tags); with "apply" it normalizes the audio to
+    LOUDNESS_TARGET. Returns what ffmpeg measured, if anything.
+    """
+    audio_format = dest.suffix.lstrip(".")
+    codec_args = audio_codec_args(source, audio_format, filtered=loudness == LOUDNESS_APPLY)
+    if loudness == LOUDNESS_APPLY:
+        codec_args += normalize_filter_args(LOUDNESS_TARGET)
+    metadata_args: list[str] = ["-metadata", f"title={title or 'untitled'}"]
+    if artist:
+        metadata_args += ["-metadata", f"artist={artist}"]
+    if release_date and len(release_date) == 8:
+        year: str = release_date[:4]
+        metadata_args += ["-metadata", f"date={year}"]
+    # Extra outputs after dest, e.g. the loudness meter
+    extra_outputs: list[str] = []
+    if loudness == LOUDNESS_TAG:
+        if known_loudness:
+            metadata_args += replaygain_tag_args(audio_format, known_loudness)
+        else:
+            extra_outputs = analysis_output_args()
+
+    if cover and cover.exists():
+        logging.info(f"[{unique_id}] Writing metadata and embedding thumbnail...")
+        try:
+            if audio_format == "opus":
+                meta_file = _opus_cover_metadata(cover, source, unique_id)
+                cover_cmd: list[str] = [
+                    FFMPEG_PATH, "-y", "-nostats", "-progress", "pipe:1",
+                    "-i", str(source),
+                    "-i", str(meta_file),
+                    "-map", "0:a", "-map_metadata", "1",
+                ] + codec_args + metadata_args + [str(dest)] + extra_outputs
+            else:
+                # The cover is re-encoded to jpeg within the same pass, so webp/png
+                # thumbnails don't need a separate conversion step
+                cover_cmd = [
+                    FFMPEG_PATH, "-y", "-nostats", "-progress", "pipe:1",
+                    "-i", str(source),
+                    "-i", str(cover),
+                    "-map", "0:a", "-map", "1:0",
+                ] + codec_args + [
+                    "-c:v", "mjpeg",
+                    "-disposition:v:0", "attached_pic",
+                ]
+                if audio_format == "mp3":
+                    cover_cmd += [
+                        "-id3v2_version", "3",
+                        "-metadata:s:v", "title=Album cover",
+                        "-metadata:s:v", "comment=Cover (front)",
+                    ]
+                cover_cmd += metadata_args + [str(dest)] + extra_outputs
+            logging.info(f"[{unique_id}] FFmpeg command: {' '.join(cover_cmd)}")
+            result = run_streaming(cover_cmd, encode_timeout(duration), ffmpeg_progress_parser(on_progress, duration))
+            logging.info(f"[{unique_id}] Metadata and thumbnail written successfully")
+            return parse_loudness(result.stderr) if loudness != LOUDNESS_OFF else None
+        except subprocess.TimeoutExpired:
+            # The audio encode is what takes the time; re-running it without the cover would time out too
+            logging.error(f"[{unique_id}] Encoding with thumbnail timed out")
+            raise RuntimeError("Encoding timed out")
+        except Exception as e:
+            logging.warning(f"[{unique_id}] Thumbnail embedding failed: {e}, writing file without thumbnail")
+    else:
+        logging.info(f"[{unique_id}] No thumbnail to embed")
+
+    # Tags only (no thumbnail, or embedding it failed)
+    basic_cmd: list[str] = [
+        FFMPEG_PATH, "-y", "-nostats", "-progress", "pipe:1", "-i", str(source), "-map", "0:a"
+    ] + codec_args + metadata_args + [str(dest)] + extra_outputs
+    logging.info(f"[{unique_id}] Basic FFmpeg command: {' '.join(basic_cmd)}")
+    try:
+        result = run_streaming(basic_cmd, encode_timeout(duration), ffmpeg_progress_parser(on_progress, duration))
+        logging.info(f"[{unique_id}] Basic metadata processing completed")
+        return parse_loudness(result.stderr) if loudness != LOUDNESS_OFF else None
+    except subprocess.TimeoutExpired:
+        logging.error(f"[{unique_id}] Basic metadata processing timed out")
+        raise RuntimeError("Basic metadata processing timed out")
+    except Exception as e:
+        logging.error(f"[{unique_id}] Basic metadata processing failed: {e}")
+        raise e
+
+def write_replaygain_tags(
+    path: Path, measurement: Dict[str, float], unique_id: str, duration: Optional[float] = None
+) -> bool:
+    """Add ReplayGain tags to an encoded file, returning whether it worked.
+
+    Tags sit in the header, ahead of the audio the measurement needed, so they are
+    added by a stream-copy remux: one sequential copy of the output, no decoding.
+    """
+    audio_format = path.suffix.lstrip(".")
+    # Named like the encode output, so a crash mid-remux leaves a sweepable temp file
+    tagged = path.with_name(f".encode_{unique_id}.replaygain{path.suffix}")
+    cmd: list[str] = [FFMPEG_PATH, "-y", "-nostats", "-i", str(path), "-map", "0", "-c", "copy"]
+    if audio_format == "mp3":
+        cmd += ["-id3v2_version", "3"]
+    cmd += replaygain_tag_args(audio_format, measurement) + [str(tagged)]
+    logging.info(f"[{unique_id}] ReplayGain FFmpeg command: {' '.join(cmd)}")
+    try:
+        run_streaming(cmd, encode_timeout(duration))
+        os.replace(tagged, path)
+        return True
+    except Exception as e:
+        # The file itself is fine, it just plays back without gain adjustment
+        logging.warning(f"[{unique_id}] Writing ReplayGain tags failed: {e}, keeping the untagged file")
+        tagged.unlink(missing_ok=True)
+        return False
+
+def needs_replaygain(path: Path, loudness: Optional[str] = None) -> bool:
+    """Whether a cached file must be tagged before answering a tag-mode request.
+
+    Tags don't change the audio, so tag mode shares its cache entry with off mode
+    and a file downloaded with loudness off is tagged on its first tag-mode hit.
+    The library only holds loudness for files whose tags were written.
+    """
+    return (loudness or LOUDNESS_MODE) == LOUDNESS_TAG and library.loudness(path=path) is None
+
+def tag_cached_file(path: Path, unique_id: str) -> Optional[Dict[str, float]]:
+    """Measure a finished file and add ReplayGain tags, keeping its mtime.
+
+    Costs a decode of the file plus the tag remux (the encode pass avoids the
+    decode for fresh downloads), so callers run it on encode_pool. Returns the
+    measurement, if any.
+    """
+    measured: Optional[Dict[str, float]] = None
+    with metrics.timed(STAGE_LOUDNESS):
+        cmd: list[str] = [FFMPEG_PATH, "-nostats", "-i", str(path)] + analysis_output_args()
+        logging.info(f"[{unique_id}] Measuring loudness of cached file: {' '.join(cmd)}")
+        try:
+            measured = parse_loudness(run_streaming(cmd, ENCODE_TIMEOUT).stderr)
+        except Exception as e:
+            logging.warning(f"[{unique_id}] Measuring loudness of {path} failed: {e}")
+        if not measured:
+            logging.warning(f"[{unique_id}] FFmpeg reported no loudness measurement for {path}")
+            return None
+        # The remux resets the release-date mtime set when the file was written
+        times = path.stat()
+        tagged = write_replaygain_tags(path, measured, unique_id)
+        os.utime(path, (times.st_atime, times.st_mtime))
+    if tagged:
+        library.set_loudness(path, measured)
+    return measured
+
+@dataclass
+class FetchedAudio:
+    """Result of the network-bound fetch stage, handed to the encode stage"""
+    url: str
+    key: str
+    unique_id: str
+    audio_format: str
+    source: Path
+    final_path: Path
+    title: Optional[str]
+    artist: Optional[str]
+    release_date: Optional[str]
+    cover: Optional[Path]
+    duration: Optional[float] = None
+    # SHA-1 of the downloaded stream, for duplicate detection in the library
+    audio_hash: Optional[str] = None
+    # Loudness mode for the encode stage (see LOUDNESS_MODE)
+    loudness: str = LOUDNESS_OFF
+    temp_files: List[Path] = field(default_factory=list)
+    # Per-stage durations in seconds plus byte/retry counts for this download
+    stats: Dict[str, float] = field(default_factory=dict)
+
+def fetch_audio(
+    url: str,
+    title: Optional[str] = None,
+    platform: str = "youtube",
+    request_id: Optional[str] = None,
+    on_stage: Optional[Callable[[str], None]] = None,
+    audio_format: str = DEFAULT_FORMAT,
+    on_progress: Optional[ProgressCallback] = None,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    loudness: Optional[str] = None,
+) -> Union[FetchedAudio, Path]:
+    """Network-bound part of a download, the same for YouTube and SoundCloud.
+
+    start/end (seconds) clip the track: only that section is downloaded and
+    encoded. loudness overrides LOUDNESS_MODE for this track. Returns a
+    FetchedAudio for the encode stage (finish_audio), or the final path of an
+    earlier download on a cache hit (which may still need tag_cached_file, see
+    needs_replaygain).
+    """
     unique_id = request_id or str(hash(url))[:8]
+
+    if audio_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported format '{audio_format}'. Choose one of: {', '.join(OUTPUT_FORMATS)}")
+    check_clip(start, end)
+    loudness = loudness or LOUDNESS_MODE
+    check_loudness_mode(loudness)
+    clipped = start is not None or end is not None
+
+    def report(stage: str) -> None:
+        if on_stage:
+            on_stage(stage)
+
+    # Return the existing file if this track was already downloaded under the same title
+    key = cache_key(url, audio_format, start, end, loudness)
+    cached = download_cache.get(key)
+    if cached and (not title or title == cached["title"]):
+        logging.info(f"[{unique_id}] Cache hit for {key}: {cached['path']}")
+        metrics.inc(CACHE_HITS)
+        print(f"✅ Already downloaded: {cached['path']}")
+        return Path(cached["path"])
     
     logging.info(f"[{unique_id}] Starting download_audio function - URL: {url}, Platform: {platform}, Title: {title}")
     
     try:
         os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+        os.makedirs(SCRATCH_DIR, exist_ok=True)
         logging.info(f"[{unique_id}] Created download directory: {DOWNLOAD_DIR}")
     except Exception as e:
         logging.error(f"[{unique_id}] Failed to create download directory: {e}")
         raise RuntimeError(f"Failed to create download directory: {e}")
     
-    if platform == "youtube":
-        logging.info(f"[{unique_id}] Processing YouTube download...")
-        
-        # Get metadata first to validate URL and get info
-        logging.info(f"[{unique_id}] Fetching metadata from URL...")
-        try:
-            metadata: Dict[str, Optional[str]] = get_metadata_from_url(url)
-            final_title: Optional[str] = title if title else metadata["title"]
-            artist: Optional[str] = metadata["uploader"]
-            release_date: Optional[str] = metadata["release_date"]
-            logging.info(f"[{unique_id}] Metadata retrieved - Title: {final_title}, Artist: {artist}")
-        except Exception as e:
-            logging.error(f"[{unique_id}] Failed to get metadata: {e}")
-            raise e
-        
-        # Set up temp file paths after successful metadata fetch
-        temp_path: Path = DOWNLOAD_DIR / f"temp_audio_{unique_id}.%(ext)s"
-        temp_mp3: Path = DOWNLOAD_DIR / f"temp_audio_{unique_id}.mp3"
-        temp_thumbnail: Path = DOWNLOAD_DIR / f"thumbnail_{unique_id}.jpg"
-        final_path: Path = DOWNLOAD_DIR / f"{sanitize_filename(final_title or 'untitled')}.mp3"
-
-        # Download audio and thumbnail using the cleaned URL
-        clean_url = clean_youtube_url(url)
-        cmd: list[str] = [
-            YTDLP_PATH,
-            '--extract-audio',
-            '--audio-format', 'mp3',
-            '--output', str(temp_path),
+    stats: Dict[str, float] = {}
+
+    if platform not in PLATFORMS:
+        raise ValueError("Unsupported platform. Only YouTube and SoundCloud are supported.")
+
+    logging.info(f"[{unique_id}] Processing {platform} download...")
+
+    # Get metadata first to validate URL and get info
+    logging.info(f"[{unique_id}] Fetching metadata from URL...")
+    report(STAGE_FETCHING_METADATA)
+    # The extraction uses the same player clients as the first download
+    # attempt so its info JSON can be handed straight to the download. It is
+    # throttled like the download too, so it walks the same client ladder with backoff
+    try:
+        with metrics.timed(STAGE_METADATA, stats):
+            for rung in range(DOWNLOAD_ATTEMPTS):
+                try:
+                    info: Dict[str, Any] = fetch_info(url, extractor_args(platform, rung), max_age=INFO_TTL)
+                    break
+                except PermanentDownloadError:
+                    raise
+                except RuntimeError as e:
+                    if rung == DOWNLOAD_ATTEMPTS - 1:
+                        raise RuntimeError(f"Metadata fetch failed after {DOWNLOAD_ATTEMPTS} attempts. {e}")
+                    retry_pause(rung, stats, unique_id)
+        metadata: Dict[str, Optional[str]] = metadata_from_info(info)
+        final_title: Optional[str] = title if title else metadata["title"]
+        artist: Optional[str] = metadata["uploader"]
+        release_date: Optional[str] = metadata["release_date"]
+        if platform == "soundcloud":
+            # Uploads are usually titled "Artist - Track" by a label or repost account
+            if " - " in (metadata["title"] or ""):
+                artist = metadata["title"].split(" - ", 1)[0].strip()
+            # SoundCloud has no release date, the upload date is the closest thing
+            release_date = release_date or info.get("upload_date")
+        logging.info(f"[{unique_id}] Metadata retrieved - Title: {final_title}, Artist: {artist}")
+    except Exception as e:
+        logging.error(f"[{unique_id}] Failed to get metadata: {e}")
+        raise e
+    
+    # Set up temp file paths after successful metadata fetch
+    temp_path: Path = SCRATCH_DIR / f"temp_audio_{unique_id}.%(ext)s"
+    temp_info: Path = SCRATCH_DIR / f"temp_audio_{unique_id}.info.json"
+    duration: Optional[float] = info.get("duration")
+    filename = sanitize_filename(final_title or 'untitled')
+    clip_args: list[str] = []
+    if clipped:
+        clip_start = start or 0
+        clip_end = end if end is not None else duration
+        if duration and clip_start >= duration:
+            raise ValueError(f"Clip start {format_timestamp(clip_start)} is past the end of the track ({format_timestamp(duration)})")
+        if clip_end is not None and duration:
+            clip_end = min(clip_end, duration)
+        # yt-dlp fetches only the fragments/byte ranges covering the section
+        clip_args = ['--download-sections', f"*{clip_start:g}-{'inf' if clip_end is None else f'{clip_end:g}'}"]
+        duration = clip_end - clip_start if clip_end is not None else None
+        filename += f" ({filename_timestamp(clip_start)}-{filename_timestamp(clip_end) if clip_end is not None else 'end'})"
+        logging.info(f"[{unique_id}] Clipping to {clip_args[1]}")
+    # Another track may already have this title; claim a free name for this one
+    final_path: Path = library.claim_path(unique_id, DOWNLOAD_DIR / f"{filename}.{audio_format}", key)
+
+    # Refuse the job if the library disk can't take the file, then wait for scratch space
+    expected_size = estimate_size(info, duration)
+    storage.check_free(expected_size)
+    storage.reserve(unique_id, expected_size)
+
+    # Save the extracted info so the first download attempt skips re-extraction
+    with open(temp_info, "w") as f:
+        json.dump(info, f)
+
+    # Download the raw audio stream and thumbnail from the saved info JSON.
+    # Encoding happens later in the encode stage, so yt-dlp only does network work here
+    clean_url = clean_youtube_url(url)
+    logging.info(f"[{unique_id}] Starting yt-dlp download ({YTDLP_MODE}), up to {DOWNLOAD_ATTEMPTS} attempts")
+    report(STAGE_DOWNLOADING)
+
+    download_start = time.monotonic()
+    for attempt in range(DOWNLOAD_ATTEMPTS):
+        # The first attempt downloads from the saved info JSON; later ones re-extract
+        # from the URL with the next player clients (after the rung the metadata
+        # extraction succeeded on), in case the stream URLs were rejected
+        info_file: Optional[str] = str(temp_info) if attempt == 0 else None
+        args: list[str] = [
+            '--format', format_selector(platform, audio_format),
             '--write-thumbnail',
             '--socket-timeout', '30',
             '--retries', '5',
             '--fragment-retries', '5',
-            '--sleep-interval', '1',
-            '--max-sleep-interval', '10',
             '--user-agent', 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            '--extractor-args', 'youtube:player_client=android,web',
             '--no-check-certificates',
             '--ignore-errors',
-            clean_url
-        ]
-        logging.info(f"[{unique_id}] Starting yt-dlp download with command: {' '.join(cmd)}")
-        
-        # Try the main download first
-        success = False
-        for attempt in range(2):
-            try:
-                if attempt == 1:
-                    # Second attempt: try with different extractor args
-                    logging.info(f"[{unique_id}] First attempt failed, trying alternative extraction method...")
-                    cmd = [
-                        YTDLP_PATH,
-                        '--extract-audio',
-                        '--audio-format', 'mp3',
-                        '--output', str(temp_path),
-                        '--write-thumbnail',
-                        '--socket-timeout', '30',
-                        '--retries', '10',
-                        '--fragment-retries', '10',
-                        '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                        '--extractor-args', 'youtube:player_client=android_music,android,web',
-                        '--no-check-certificates',
-                        '--ignore-errors',
-                        '--force-ipv4',
-                        clean_url
-                    ]
-                    logging.info(f"[{unique_id}] Retry command: {' '.join(cmd)}")
-                
-                result = subprocess.run(
-                    cmd,
-                    check=True,
-                    stdin=subprocess.DEVNULL,
-                    capture_output=True,
-                    text=True,
-                    timeout=300,  # 5 minute timeout for download
-                    cwd=str(DOWNLOAD_DIR)  # Set working directory
-                )
-                logging.info(f"[{unique_id}] yt-dlp download completed successfully on attempt {attempt + 1}")
-                if result.stdout:
-                    logging.info(f"[{unique_id}] yt-dlp stdout: {result.stdout[:200]}")
-                success = True
-                break
-                
-            except subprocess.TimeoutExpired:
-                logging.error(f"[{unique_id}] yt-dlp download timed out on attempt {attempt + 1}")
-                if attempt == 1:
-                    raise RuntimeError(f"Download timed out after 5 minutes on all attempts. The video might be too large or connection is slow.")
-            except subprocess.CalledProcessError as e:
-                logging.error(f"[{unique_id}] yt-dlp download failed on attempt {attempt + 1} with return code {e.returncode}")
-                logging.error(f"[{unique_id}] yt-dlp stderr: {e.stderr}")
-                if e.stdout:
-                    logging.error(f"[{unique_id}] yt-dlp stdout: {e.stdout}")
-                if attempt == 1:
-                    raise RuntimeError(f"Download failed on all attempts: yt-dlp error code {e.returncode}. YouTube may be blocking this video.")
-            except Exception as e:
-                logging.error(f"[{unique_id}] Unexpected error during yt-dlp download on attempt {attempt + 1}: {e}")
-                if attempt == 1:
-                    raise RuntimeError(f"Unexpected download error on all attempts: {e}")
-        
-        if not success:
-            raise RuntimeError("Download failed on all attempts")
-
-        logging.info(f"[{unique_id}] yt-dlp download complete, starting post-processing...")
-
-        # Check if the main audio file was created
-        if not temp_mp3.exists():
-            logging.error(f"[{unique_id}] Audio file not found at {temp_mp3}")
-            raise RuntimeError("Audio file was not created by yt-dlp")
-        
-        logging.info(f"[{unique_id}] Audio file found at {temp_mp3}")
-
-        # Find the downloaded thumbnail (yt-dlp may save as .webp or .jpg)
-        thumb_file: Optional[Path] = None
-        for ext in ['jpg', 'webp', 'png']:
-            candidate: Path = DOWNLOAD_DIR / f"temp_audio_{unique_id}.{ext}"
-            if candidate.exists():
-                thumb_file = candidate
-                logging.info(f"[{unique_id}] Found thumbnail: {candidate}")
-                break
-        
-        if not thumb_file:
-            logging.info(f"[{unique_id}] No thumbnail found")
+            '--continue',  # Resume a .part file left by an interrupted run of this job
+        ] + extractor_args(platform, rung + attempt) + clip_args
+        if attempt > 0:
+            args.append('--force-ipv4')
+        logging.info(f"[{unique_id}] Attempt {attempt + 1} args: {' '.join(args)}")
 
-        # Convert thumbnail to jpg if needed
-        if thumb_file and thumb_file.suffix != ".jpg":
-            logging.info(f"[{unique_id}] Converting thumbnail from {thumb_file.suffix} to .jpg")
-            try:
-                subprocess.run(
-                    [
-                        FFMPEG_PATH, "-y", "-i", str(thumb_file), str(temp_thumbnail)
-                    ],
-                    check=True,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                    timeout=30  # Add timeout for ffmpeg
-                )
-                logging.info(f"[{unique_id}] Thumbnail conversion completed")
-            except subprocess.TimeoutExpired:
-                logging.error(f"[{unique_id}] Thumbnail conversion timed out")
-                raise RuntimeError("Thumbnail conversion timed out")
-            except Exception as e:
-                logging.error(f"[{unique_id}] Thumbnail conversion failed: {e}")
-                raise e
-            thumb_file.unlink()
-            thumb_file = temp_thumbnail
-
-        # Prepare ffmpeg metadata args
-        metadata_args: list[str] = ["-metadata", f"title={final_title or 'untitled'}"]
-        if artist:
-            metadata_args += ["-metadata", f"artist={artist}"]
-        if release_date and len(release_date) == 8:
-            year: str = release_date[:4]
-            metadata_args += ["-metadata", f"date={year}"]
-
-        # First, just copy the audio with basic metadata (no thumbnail)
-        logging.info(f"[{unique_id}] Starting basic metadata processing (no thumbnail)...")
-        basic_ffmpeg_cmd: list[str] = [
-            FFMPEG_PATH, "-y", "-i", str(temp_mp3), "-c", "copy"
-        ] + metadata_args + [str(final_path)]
-        
-        logging.info(f"[{unique_id}] Basic FFmpeg command: {' '.join(basic_ffmpeg_cmd)}")
-        
+        rate_limiter.acquire(platform)
         try:
-            subprocess.run(
-                basic_ffmpeg_cmd,
-                check=True,
-                stdin=subprocess.DEVNULL,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                timeout=60,  # 1 minute timeout for basic processing
-                cwd=str(DOWNLOAD_DIR)  # Set working directory
+            stdout = run_ytdlp_download(
+                args,
+                str(temp_path),
+                url=clean_url,
+                info_file=info_file,
+                on_progress=on_progress,
+                # 5 minutes, or longer for long sources/sections (at least realtime speed)
+                timeout=max(300, duration or 0),
             )
-            logging.info(f"[{unique_id}] Basic metadata processing completed")
+            logging.info(f"[{unique_id}] yt-dlp download completed successfully on attempt {attempt + 1}")
+            if stdout:
+                logging.info(f"[{unique_id}] yt-dlp stdout: {stdout[-200:]}")
+            break
         except subprocess.TimeoutExpired:
-            logging.error(f"[{unique_id}] Basic metadata processing timed out")
-            raise RuntimeError("Basic metadata processing timed out")
+            logging.error(f"[{unique_id}] yt-dlp download timed out on attempt {attempt + 1}")
+            failure = "Download timed out. The video might be too large or connection is slow."
+        except subprocess.CalledProcessError as e:
+            logging.error(f"[{unique_id}] yt-dlp download failed on attempt {attempt + 1} with return code {e.returncode}")
+            logging.error(f"[{unique_id}] yt-dlp stderr: {e.stderr}")
+            if e.stdout:
+                logging.error(f"[{unique_id}] yt-dlp stdout: {e.stdout}")
+            if classify_error(e.stderr) == PERMANENT:
+                raise PermanentDownloadError(f"Video is unavailable: {error_summary(e.stderr)}")
+            failure = f"yt-dlp error code {e.returncode}: {error_summary(e.stderr)}"
         except Exception as e:
-            logging.error(f"[{unique_id}] Basic metadata processing failed: {e}")
-            raise e
-
-        # Now try to add thumbnail if available (optional, don't fail if it doesn't work)
-        if thumb_file and thumb_file.exists():
-            logging.info(f"[{unique_id}] Attempting to embed thumbnail...")
-            temp_with_thumb = DOWNLOAD_DIR / f"temp_with_thumb_{unique_id}.mp3"
-            
-            thumb_ffmpeg_cmd: list[str] = [
-                FFMPEG_PATH, "-y", 
-                "-i", str(final_path), 
-                "-i", str(thumb_file),
-                "-map", "0:a", "-map", "1:0", 
-                "-c:a", "copy", "-c:v", "mjpeg",
-                "-id3v2_version", "3",
-                "-metadata:s:v", "title=Album cover", 
-                "-metadata:s:v", "comment=Cover (front)",
-                str(temp_with_thumb)
-            ]
-            
-            try:
-                subprocess.run(
-                    thumb_ffmpeg_cmd,
-                    check=True,
-                    stdin=subprocess.DEVNULL,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                    timeout=60,  # 1 minute timeout for thumbnail embedding
-                    cwd=str(DOWNLOAD_DIR)  # Set working directory
-                )
-                logging.info(f"[{unique_id}] Thumbnail embedding completed successfully")
-                # Replace the original with the one that has thumbnail
-                final_path.unlink()
-                temp_with_thumb.rename(final_path)
-            except subprocess.TimeoutExpired:
-                logging.warning(f"[{unique_id}] Thumbnail embedding timed out, keeping file without thumbnail")
-                if temp_with_thumb.exists():
-                    temp_with_thumb.unlink()
-            except Exception as e:
-                logging.warning(f"[{unique_id}] Thumbnail embedding failed: {e}, keeping file without thumbnail")
-                if temp_with_thumb.exists():
-                    temp_with_thumb.unlink()
-        else:
-            logging.info(f"[{unique_id}] No thumbnail to embed")
-
-        # Set file modification time to release date if available
-        if final_path.exists() and release_date:
-            logging.info(f"[{unique_id}] Setting file modification time to {release_date}")
-            set_file_mtime(final_path, release_date)
-
-        # Clean up all temp files
-        logging.info(f"[{unique_id}] Cleaning up temporary files...")
-        temp_files = [temp_mp3, temp_thumbnail]
-        if thumb_file and thumb_file != temp_thumbnail:
-            temp_files.append(thumb_file)
-        
-        for temp_file in temp_files:
+            logging.error(f"[{unique_id}] Unexpected error during yt-dlp download on attempt {attempt + 1}: {e}")
+            failure = f"Unexpected download error: {e}"
+
+        if attempt == DOWNLOAD_ATTEMPTS - 1:
+            raise RuntimeError(f"Download failed after {DOWNLOAD_ATTEMPTS} attempts. {failure}")
+        retry_pause(attempt, stats, unique_id)
+
+    stats[STAGE_DOWNLOAD] = time.monotonic() - download_start
+    metrics.observe(STAGE_DOWNLOAD, stats[STAGE_DOWNLOAD])
+
+    # Find the downloaded audio stream (extension depends on the selected format)
+    temp_audio: Optional[Path] = None
+    for candidate in sorted(SCRATCH_DIR.glob(f"temp_audio_{unique_id}.*")):
+        if candidate.suffix not in NON_AUDIO_SUFFIXES:
+            temp_audio = candidate
+            break
+
+    if not temp_audio:
+        logging.error(f"[{unique_id}] Audio file not found for temp_audio_{unique_id}")
+        raise RuntimeError("Audio file was not created by yt-dlp")
+    
+    logging.info(f"[{unique_id}] Audio file found at {temp_audio}")
+    audio_hash = file_sha1(temp_audio)
+
+    # Find the downloaded thumbnail (yt-dlp may save as .webp or .jpg)
+    thumb_file: Optional[Path] = None
+    for ext in ['jpg', 'webp', 'png']:
+        candidate: Path = SCRATCH_DIR / f"temp_audio_{unique_id}.{ext}"
+        if candidate.exists():
+            thumb_file = candidate
+            logging.info(f"[{unique_id}] Found thumbnail: {candidate}")
+            break
+    
+    if not thumb_file:
+        logging.info(f"[{unique_id}] No thumbnail found")
+
+    temp_files = [temp_audio, temp_info]
+    if thumb_file:
+        temp_files.append(thumb_file)
+
+    stats[BYTES_DOWNLOADED] = sum(f.stat().st_size for f in (temp_audio, thumb_file) if f)
+    metrics.inc(BYTES_DOWNLOADED, stats[BYTES_DOWNLOADED])
+
+    return FetchedAudio(
+        url=url,
+        key=key,
+        unique_id=unique_id,
+        audio_format=audio_format,
+        source=temp_audio,
+        final_path=final_path,
+        title=final_title,
+        artist=artist,
+        release_date=release_date,
+        cover=thumb_file,
+        duration=duration,
+        audio_hash=audio_hash,
+        loudness=loudness,
+        temp_files=temp_files,
+        stats=stats,
+    )
+
+def finish_audio(
+    fetched: FetchedAudio,
+    on_stage: Optional[Callable[[str], None]] = None,
+    on_progress: Optional[ProgressCallback] = None,
+) -> Path:
+    """CPU-bound part of a download: encode, tag, set mtime and clean up"""
+    unique_id = fetched.unique_id
+    final_path = fetched.final_path
+
+    logging.info(f"[{unique_id}] yt-dlp download complete, starting post-processing...")
+    if on_stage:
+        on_stage(STAGE_POST_PROCESSING)
+
+    # Encode next to the final file, so moving it into place is an atomic rename
+    # and the library never holds a half-written track
+    partial_path = final_path.with_name(f".encode_{unique_id}{final_path.suffix}")
+
+    # The same audio was measured before (another name, URL or format): reuse the numbers
+    known_loudness: Optional[Dict[str, float]] = None
+    if fetched.loudness == LOUDNESS_TAG and fetched.audio_hash:
+        known_loudness = library.loudness(audio_hash=fetched.audio_hash)
+        if known_loudness:
+            logging.info(f"[{unique_id}] Reusing loudness measurement of identical audio: {known_loudness}")
+
+    # Encode (or stream copy) with tags and cover art in a single ffmpeg pass
+    with metrics.timed(STAGE_ENCODE_TAG, fetched.stats):
+        measured = encode_and_tag(
+            fetched.source,
+            partial_path,
+            fetched.title,
+            fetched.artist,
+            fetched.release_date,
+            fetched.cover,
+            unique_id,
+            on_progress=on_progress,
+            duration=fetched.duration,
+            loudness=fetched.loudness,
+            known_loudness=known_loudness,
+        )
+
+    if not partial_path.exists():
+        raise RuntimeError("FFmpeg did not produce an output file")
+
+    if fetched.loudness != LOUDNESS_OFF and not (known_loudness or measured):
+        logging.warning(f"[{unique_id}] FFmpeg reported no loudness measurement")
+    # Tags from an earlier measurement went in with the encode pass
+    tagged = bool(known_loudness)
+    if fetched.loudness == LOUDNESS_TAG and measured and not known_loudness:
+        with metrics.timed(STAGE_LOUDNESS, fetched.stats):
+            tagged = write_replaygain_tags(partial_path, measured, unique_id, fetched.duration)
+    # In apply mode these describe the source, before normalization
+    loudness = known_loudness or measured
+    if loudness:
+        fetched.stats.update(loudness)
+        if fetched.loudness == LOUDNESS_TAG:
+            fetched.stats["replaygain_db"] = replaygain_db(loudness)
+
+    # Set file modification time to release date if available
+    if fetched.release_date:
+        logging.info(f"[{unique_id}] Setting file modification time to {fetched.release_date}")
+        set_file_mtime(partial_path, fetched.release_date)
+    os.replace(partial_path, final_path)
+    library.put(
+        final_path,
+        fetched.key,
+        fetched.url,
+        fetched.title,
+        fetched.artist,
+        fetched.audio_format,
+        fetched.duration,
+        final_path.stat().st_size,
+        fetched.audio_hash,
+        # Only tagged files still have the measured loudness; a file whose tags
+        # failed is left without, so the next tag-mode request retries them
+        loudness if fetched.loudness == LOUDNESS_TAG and tagged else None,
+    )
+
+    # Clean up all temp files
+    logging.info(f"[{unique_id}] Cleaning up temporary files...")
+    with metrics.timed(STAGE_CLEANUP, fetched.stats):
+        for temp_file in fetched.temp_files:
             if temp_file and temp_file.exists():
                 temp_file.unlink()
         
         # Also clean up any remaining temp files for this specific download
-        for pattern in [f'temp_audio_{unique_id}.*', f'thumbnail_{unique_id}.*']:
-            for leftover in DOWNLOAD_DIR.glob(pattern):
-                if leftover.exists():
-                    leftover.unlink()
+        remove_temp_files(unique_id)
 
-        print(f"✅ Downloaded to: {final_path}")
-        logging.info(f"[{unique_id}] YouTube download completed successfully: {final_path}")
-        logging.info(f"[{unique_id}] Final file size: {final_path.stat().st_size if final_path.exists() else 'File not found'} bytes")
-    elif platform == "soundcloud":
-        # SoundCloud download logic using scdl
-        # scdl handles metadata quite well on its own, but we can enhance it
-        
-        # First try to get metadata using yt-dlp for consistency
+    if final_path.exists():
+        fetched.stats[BYTES_WRITTEN] = final_path.stat().st_size
+        metrics.inc(BYTES_WRITTEN, fetched.stats[BYTES_WRITTEN])
+
+    download_cache.put(fetched.key, fetched.url, final_path, fetched.title, fetched.artist, fetched.release_date)
+
+    print(f"✅ Downloaded to: {final_path}")
+    logging.info(f"[{unique_id}] Download completed successfully: {final_path}")
+    logging.info(f"[{unique_id}] Final file size: {final_path.stat().st_size if final_path.exists() else 'File not found'} bytes")
+    logging.info(f"[{unique_id}] Stage stats: {fetched.stats}")
+    return final_path
+
+def download_audio(
+    url: str,
+    title: Optional[str] = None,
+    platform: str = "youtube",
+    request_id: Optional[str] = None,
+    on_stage: Optional[Callable[[str], None]] = None,
+    audio_format: str = DEFAULT_FORMAT,
+    on_progress: Optional[ProgressCallback] = None,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    loudness: Optional[str] = None,
+) -> Optional[Path]:
+    request_id = request_id or str(hash(url))[:8]
+    with metrics.timed(STAGE_TOTAL):
         try:
-            metadata: Dict[str, Optional[str]] = get_metadata_from_url(url)
-            final_title: Optional[str] = title if title else metadata["title"]
+            fetched = fetch_audio(
+                url, title, platform, request_id, on_stage, audio_format, on_progress, start, end, loudness
+            )
+            # The encode stage runs on its own pool so concurrent downloads can't oversubscribe the CPU
+            if not isinstance(fetched, FetchedAudio):
+                if needs_replaygain(fetched, loudness):
+                    encode_pool.submit(tag_cached_file, fetched, request_id).result()
+                return fetched
+            return encode_pool.submit(finish_audio, fetched, on_stage, on_progress).result()
         except Exception:
-            # Fallback if yt-dlp can't handle the SoundCloud URL
-            final_title = title
-        
-        # Use scdl to download with proper options
-        cmd: list[str] = [
-            SCDL_PATH,
-            "-l", url,
-            "--path", str(DOWNLOAD_DIR),  # Use --path for output directory
-            "--onlymp3",
-            "--original-art",  # Download original cover art
-            "--extract-artist"  # Set artist tag from title instead of username
-        ]
-        
-        # Add custom name format if we have a title
-        if final_title:
-            sanitized_title = sanitize_filename(final_title)
-            cmd.extend(["--name-format", f"{sanitized_title}.%(ext)s"])
-        
+            remove_temp_files(request_id)
+            raise
+
+def download_many(
+    entries: List[Dict[str, Optional[str]]],
+    platform: Optional[str] = None,
+    concurrency: int = BATCH_CONCURRENCY,
+    audio_format: str = DEFAULT_FORMAT,
+    on_track: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+    loudness: Optional[str] = None,
+    on_stage: Optional[Callable[[int, str], None]] = None,
+    id_prefix: str = "batch",
+) -> List[Dict[str, Any]]:
+    """Download a list of {"url", "title"} entries, a few at a time.
+
+    platform defaults to each URL's own. Entries for the same track (same
+    cache key) are downloaded once and share the result. Failed tracks are
+    recorded in the returned list instead of aborting the rest. on_stage is
+    called with (index, stage) as each track moves through the pipeline, and
+    on_track with (index, result) as each track finishes.
+    """
+    # Indexes of the entries each download serves, by cache key
+    groups: Dict[str, List[int]] = {}
+    for index, entry in enumerate(entries):
+        key = cache_key(entry["url"] or "", audio_format, loudness=loudness)
+        groups.setdefault(key, []).append(index)
+
+    def run(indexes: List[int]) -> Dict[str, Any]:
+        first = indexes[0]
+        url = entries[first]["url"] or ""
+        result: Dict[str, Any] = {"url": url}
         try:
-            subprocess.run(
-                cmd, 
-                check=True,
-                # stdout=subprocess.DEVNULL,
-                # stderr=subprocess.DEVNULL
+            final_path = download_audio(
+                url,
+                platform=platform or url_platform(url),
+                # Temp files and claims are named after the request ID, so it must be unique per download
+                request_id=f"{id_prefix}_{first}_{uuid.uuid4().hex[:8]}",
+                on_stage=(lambda stage: [on_stage(i, stage) for i in indexes]) if on_stage else None,
+                audio_format=audio_format,
+                loudness=loudness,
             )
-            print(f"✅ Downloaded SoundCloud track to: {DOWNLOAD_DIR}")
-            logging.info(f"SoundCloud download completed to: {DOWNLOAD_DIR}")
-        except subprocess.CalledProcessError as e:
-            logging.error(f"SoundCloud download failed: {e}")
-            raise RuntimeError(f"SoundCloud download failed: {e}")
-    else:
-        raise ValueError("Unsupported platform. Only YouTube and SoundCloud are supported.")
\ No newline at end of file
+            result.update(status="success", path=str(final_path) if final_path else None)
+        except Exception as e:
+            logging.error(f"Track {first + 1}/{len(entries)} failed: {url}: {e}")
+            result.update(status="error", reason=str(e))
+        return result
+
+    results: List[Dict[str, Any]] = []
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {pool.submit(run, indexes): indexes for indexes in groups.values()}
+        for future in as_completed(futures):
+            outcome = future.result()
+            for index in futures[future]:
+                result = {**outcome, "index": index, "url": entries[index]["url"], "title": entries[index].get("title")}
+                results.append(result)
+                if on_track:
+                    on_track(index, result)
+
+    results.sort(key=lambda r: r["index"])
+    return results
+
+def download_batch(
+    url: str,
+    platform: str = "youtube",
+    concurrency: int = BATCH_CONCURRENCY,
+    audio_format: str = DEFAULT_FORMAT,
+    on_track: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+    loudness: Optional[str] = None,
+    on_stage: Optional[Callable[[int, str], None]] = None,
+) -> List[Dict[str, Any]]:
+    """Download every track of a playlist/set, a few at a time (see download_many)"""
+    playlist = expand_playlist(url)
+    entries = playlist["entries"]
+    print(f"📃 {playlist['title'] or 'Playlist'}: {len(entries)} tracks")
+
+    results = download_many(entries, platform, concurrency, audio_format, on_track, loudness, on_stage)
+    failed = sum(1 for r in results if r["status"] != "success")
+    logging.info(f"Batch {playlist['url']} finished: {len(results) - failed} succeeded, {failed} failed")
+    return results
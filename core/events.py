@@ -0,0 +1,44 @@
+import asyncio
+import threading
+from typing import Dict, Any, List, Tuple, Optional
+
+
+class EventBus:
+    """Fan out job events from worker threads to asyncio subscribers (SSE streams).
+
+    publish() is safe to call from any thread; each subscriber gets its own
+    bounded queue and silently drops events if it falls too far behind.
+    """
+
+    def __init__(self, max_pending: int = 1000) -> None:
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._subscribers: List[Tuple[asyncio.AbstractEventLoop, "asyncio.Queue[Dict[str, Any]]", Optional[str]]] = []
+
+    def subscribe(self, job_id: Optional[str] = None) -> "asyncio.Queue[Dict[str, Any]]":
+        """Must be called from the event loop that will consume the queue"""
+        queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=self.max_pending)
+        with self._lock:
+            self._subscribers.append((asyncio.get_running_loop(), queue, job_id))
+        return queue
+
+    def unsubscribe(self, queue: "asyncio.Queue[Dict[str, Any]]") -> None:
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s[1] is not queue]
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, queue, job_id in subscribers:
+            if job_id is not None and event.get("job_id") != job_id:
+                continue
+            try:
+                loop.call_soon_threadsafe(self._put, queue, event)
+            except RuntimeError:
+                # Loop already closed, the subscriber is gone
+                self.unsubscribe(queue)
+
+    @staticmethod
+    def _put(queue: "asyncio.Queue[Dict[str, Any]]", event: Dict[str, Any]) -> None:
+        if not queue.full():
+            queue.put_nowait(event)
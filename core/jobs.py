@@ -0,0 +1,462 @@
+import os
+import queue
+import threading
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Optional, Any, List
+
+from core.cache import JobJournal
+from core.events import EventBus
+from core.metrics import metrics, STAGE_QUEUE_WAIT, STAGE_TOTAL, JOBS_COMPLETED, JOBS_FAILED
+from core.downloader import (
+    fetch_audio,
+    finish_audio,
+    encode_pool,
+    FetchedAudio,
+    cache_key,
+    download_cache,
+    library,
+    needs_replaygain,
+    tag_cached_file,
+    remove_temp_files,
+    sweep_temp_files,
+    DEFAULT_FORMAT,
+    STAGE_FETCHING_METADATA,
+    STAGE_DOWNLOADING,
+    STAGE_POST_PROCESSING,
+)
+
+# Number of downloads processed concurrently by the server
+JOB_WORKERS: int = int(os.environ.get("SPOTIFYTOOL_WORKERS", "3"))
+# Minimum seconds between progress events published for one job
+PROGRESS_INTERVAL: float = 0.25
+# How many finished jobs are kept around for the status endpoints
+JOB_HISTORY_LIMIT: int = int(os.environ.get("SPOTIFYTOOL_JOB_HISTORY", "500"))
+# Restarts a journaled job survives before it is dropped instead of resumed
+# (guards against a job that keeps taking the server down)
+JOB_RESUME_LIMIT: int = int(os.environ.get("SPOTIFYTOOL_RESUME_LIMIT", "3"))
+
+STATE_QUEUED = "queued"
+STATE_FETCHING_METADATA = STAGE_FETCHING_METADATA
+STATE_DOWNLOADING = STAGE_DOWNLOADING
+STATE_POST_PROCESSING = STAGE_POST_PROCESSING
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+FINISHED_STATES = (STATE_DONE, STATE_FAILED)
+
+
+@dataclass
+class Job:
+    id: str
+    url: str
+    title: Optional[str]
+    platform: str
+    audio_format: str = DEFAULT_FORMAT
+    # Canonical track ID, used to share one job between duplicate requests
+    key: str = ""
+    # Section of the track to download, in seconds (None: from the start / to the end)
+    start: Optional[float] = None
+    end: Optional[float] = None
+    # Loudness mode ("off", "tag", "apply"); None uses the server's SPOTIFYTOOL_LOUDNESS
+    loudness: Optional[str] = None
+    state: str = STATE_QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    # Time at which each state was entered
+    stage_times: Dict[str, float] = field(default_factory=dict)
+    result: Optional[str] = None
+    error: Optional[str] = None
+    cached: bool = False
+    # Whether the job has a journal row to remove when it finishes
+    journaled: bool = field(default=False, repr=False)
+    # Per-stage durations, byte/retry counts and loudness measurements reported by the pipeline
+    stats: Dict[str, float] = field(default_factory=dict)
+    # Latest progress event (percent, speed, eta...) for the current stage
+    progress: Optional[Dict[str, Any]] = None
+    last_progress_at: float = field(default=0.0, repr=False)
+
+    @property
+    def queued_at(self) -> float:
+        """When the job last entered the queue: created_at, or the restart time for resumed jobs"""
+        return self.stage_times.get(STATE_QUEUED, self.created_at)
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.time()
+        end = self.finished_at or now
+        return {
+            "id": self.id,
+            "url": self.url,
+            "title": self.title,
+            "platform": self.platform,
+            "audio_format": self.audio_format,
+            "key": self.key,
+            "start": self.start,
+            "end": self.end,
+            "loudness": self.loudness,
+            "state": self.state,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queue_seconds": (self.started_at or end) - self.queued_at,
+            "elapsed_seconds": end - self.queued_at,
+            "stage_times": dict(self.stage_times),
+            "result": self.result,
+            "error": self.error,
+            "cached": self.cached,
+            "stats": dict(self.stats),
+            "progress": self.progress,
+        }
+
+
+@dataclass
+class Batch:
+    id: str
+    url: str
+    title: Optional[str]
+    job_ids: List[str]
+    created_at: float = field(default_factory=time.time)
+
+
+class JobQueue:
+    """Bounded pool of worker threads draining a FIFO of download jobs."""
+
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        history_limit: int = JOB_HISTORY_LIMIT,
+        events: Optional[EventBus] = None,
+        journal: Optional[JobJournal] = None,
+    ) -> None:
+        self.workers = max(1, workers)
+        self.history_limit = history_limit
+        # State changes and progress of every job are published here
+        self.events = events or EventBus()
+        # Unfinished jobs are journaled next to the download cache and re-queued on start
+        self.journal = journal or JobJournal(download_cache.db_path)
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        # Canonical track ID -> ID of the unfinished job downloading it
+        self._active: Dict[str, str] = {}
+        self._batches: "OrderedDict[str, Batch]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._resume()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"download-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info(f"Started {self.workers} download workers")
+
+    def stop(self) -> None:
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def submit(
+        self,
+        url: str,
+        title: Optional[str],
+        platform: str,
+        audio_format: str = DEFAULT_FORMAT,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        loudness: Optional[str] = None,
+    ) -> Job:
+        key = cache_key(url, audio_format, start, end, loudness)
+        with self._lock:
+            # Attach to a job that is already downloading the same track
+            existing = self._jobs.get(self._active.get(key, ""))
+            if existing and (not title or title == existing.title):
+                logging.info(f"Request for {url} attached to running job [{existing.id}]")
+                return existing
+
+        job = Job(
+            id=uuid.uuid4().hex[:12],
+            url=url,
+            title=title,
+            platform=platform,
+            audio_format=audio_format,
+            key=key,
+            start=start,
+            end=end,
+            loudness=loudness,
+        )
+        job.stage_times[STATE_QUEUED] = job.created_at
+
+        # Finished before: answer from the download cache without queueing, unless
+        # the file still needs ReplayGain tags (the worker adds them)
+        cached = download_cache.get(key)
+        if cached and (not title or title == cached["title"]) and not needs_replaygain(Path(cached["path"]), loudness):
+            job.cached = True
+            job.result = cached["path"]
+            job.started_at = job.created_at
+            # Report the loudness measured when the file was written instead of measuring again
+            try:
+                job.stats.update(library.loudness(path=Path(cached["path"])) or {})
+            except Exception as e:
+                logging.warning(f"Failed to read loudness for [{job.id}] from the library: {e}")
+            self._set_state(job, STATE_DONE)
+            with self._lock:
+                self._jobs[job.id] = job
+                self._prune()
+            logging.info(f"Cache hit for job [{job.id}]: {url} -> {job.result}")
+            return job
+
+        with self._lock:
+            self._jobs[job.id] = job
+            self._active[key] = job.id
+            self._prune()
+        self._write_journal(
+            self.journal.add,
+            job.id, url, title, platform, audio_format, key, job.state, job.created_at, start, end, loudness,
+        )
+        job.journaled = True
+        self._queue.put(job.id)
+        logging.info(f"Queued job [{job.id}]: {url}, title: {title}")
+        return job
+
+    def _resume(self) -> None:
+        """Re-queue the jobs a previous run left unfinished and reclaim orphaned temp files.
+
+        Resumed jobs keep their ID, so yt-dlp continues their partial download.
+        """
+        try:
+            rows = self.journal.resume()
+        except Exception as e:
+            logging.error(f"Failed to read job journal: {e}")
+            rows = []
+        resumed: List[str] = []
+        for row in rows:
+            if row["resumes"] > JOB_RESUME_LIMIT:
+                logging.warning(f"Dropping job [{row['id']}] after {JOB_RESUME_LIMIT} resumes: {row['url']}")
+                self._write_journal(self.journal.remove, row["id"])
+                continue
+            job = Job(
+                id=row["id"],
+                url=row["url"],
+                title=row["title"],
+                platform=row["platform"],
+                audio_format=row["audio_format"],
+                key=row["key"],
+                start=row["clip_start"],
+                end=row["clip_end"],
+                loudness=row["loudness"],
+                created_at=row["created_at"],
+            )
+            job.stage_times[STATE_QUEUED] = time.time()
+            job.journaled = True
+            with self._lock:
+                self._jobs[job.id] = job
+                self._active[job.key] = job.id
+            self._queue.put(job.id)
+            resumed.append(job.id)
+            logging.info(f"Resumed job [{job.id}] (was {row['state']}): {job.url}")
+        freed = sweep_temp_files(keep=resumed)
+        if resumed or freed:
+            logging.info(f"Resumed {len(resumed)} jobs, reclaimed {freed} bytes of orphaned temp files")
+
+    def _write_journal(self, write: Callable[..., None], *args: Any) -> None:
+        # The journal only matters after a crash; never fail a download over it
+        try:
+            write(*args)
+        except Exception as e:
+            logging.warning(f"Failed to update job journal: {e}")
+
+    def submit_batch(
+        self,
+        url: str,
+        title: Optional[str],
+        entries: List[Dict[str, Any]],
+        platform: str,
+        audio_format: str = DEFAULT_FORMAT,
+        loudness: Optional[str] = None,
+    ) -> Batch:
+        """Queue one job per playlist track; the worker pool bounds how many run at once"""
+        jobs = [self.submit(entry["url"], None, platform, audio_format, loudness=loudness) for entry in entries]
+        batch = Batch(id=uuid.uuid4().hex[:12], url=url, title=title, job_ids=[job.id for job in jobs])
+        with self._lock:
+            self._batches[batch.id] = batch
+            while len(self._batches) > self.history_limit:
+                self._batches.popitem(last=False)
+        logging.info(f"Queued batch [{batch.id}] with {len(jobs)} tracks: {url}")
+        return batch
+
+    def batch_status(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is None:
+                return None
+            jobs = [self._jobs.get(job_id) for job_id in batch.job_ids]
+        counts: Dict[str, int] = {}
+        for job in jobs:
+            state = job.state if job else "expired"
+            counts[state] = counts.get(state, 0) + 1
+        finished = sum(1 for job in jobs if job is None or job.state in FINISHED_STATES)
+        return {
+            "id": batch.id,
+            "url": batch.url,
+            "title": batch.title,
+            "created_at": batch.created_at,
+            "total": len(jobs),
+            "finished": finished,
+            "complete": finished == len(jobs),
+            "counts": counts,
+            "jobs": [job.to_dict() for job in jobs if job],
+        }
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def state_counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job.state] = counts.get(job.state, 0) + 1
+        return counts
+
+    def _set_state(self, job: Job, state: str) -> None:
+        with self._lock:
+            job.state = state
+            job.stage_times[state] = time.time()
+            job.progress = None
+            if state in FINISHED_STATES:
+                job.finished_at = job.stage_times[state]
+                if self._active.get(job.key) == job.id:
+                    del self._active[job.key]
+        if state in FINISHED_STATES:
+            if job.journaled:
+                self._write_journal(self.journal.remove, job.id)
+        else:
+            self._write_journal(self.journal.set_state, job.id, state)
+        self.events.publish({"type": "state", "job_id": job.id, "job": job.to_dict()})
+
+    def _set_progress(self, job: Job, progress: Dict[str, Any]) -> None:
+        job.progress = progress
+        # Progress lines arrive many times a second; only publish a few of them
+        now = time.monotonic()
+        if now - job.last_progress_at < PROGRESS_INTERVAL and progress.get("percent") != 100.0:
+            return
+        job.last_progress_at = now
+        self.events.publish({"type": "progress", "job_id": job.id, "state": job.state, **progress})
+
+    def _prune(self) -> None:
+        # Drop the oldest finished jobs once the history grows past the limit
+        excess = len(self._jobs) - self.history_limit
+        if excess <= 0:
+            return
+        for job_id in [j.id for j in self._jobs.values() if j.state in FINISHED_STATES][:excess]:
+            del self._jobs[job_id]
+
+    def _worker(self) -> None:
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                break
+            job = self.get(job_id)
+            if job is not None:
+                self._run(job)
+            self._queue.task_done()
+
+    def _run(self, job: Job) -> None:
+        job.started_at = time.time()
+        # Measured from the last (re-)queue so a resumed job doesn't count server downtime
+        job.stats[STAGE_QUEUE_WAIT] = job.started_at - job.queued_at
+        metrics.observe(STAGE_QUEUE_WAIT, job.stats[STAGE_QUEUE_WAIT])
+        logging.info(f"Starting job [{job.id}] after {job.stats[STAGE_QUEUE_WAIT]:.2f}s in queue")
+        on_stage = lambda stage: self._set_state(job, stage)
+        on_progress = lambda progress: self._set_progress(job, progress)
+        try:
+            fetched = fetch_audio(
+                job.url,
+                title=job.title,
+                platform=job.platform,
+                request_id=job.id,
+                on_stage=on_stage,
+                audio_format=job.audio_format,
+                on_progress=on_progress,
+                start=job.start,
+                end=job.end,
+                loudness=job.loudness,
+            )
+        except Exception as e:
+            self._fail(job, e)
+            return
+
+        if not isinstance(fetched, FetchedAudio):
+            job.cached = True
+            path: Path = fetched
+            if needs_replaygain(path, job.loudness):
+                # Measuring decodes the whole file, so it goes to the encode pool like finish_audio
+                tagging: "Future[Optional[Dict[str, float]]]" = encode_pool.submit(tag_cached_file, path, job.id)
+
+                def tagged(f: "Future[Optional[Dict[str, float]]]") -> None:
+                    if f.exception():
+                        logging.warning(f"Tagging cached file for [{job.id}] failed: {f.exception()}")
+                    else:
+                        job.stats.update(f.result() or {})
+                    self._complete(job, path)
+
+                tagging.add_done_callback(tagged)
+                return
+            # Report the loudness stored when the file was tagged
+            try:
+                job.stats.update(library.loudness(path=path) or {})
+            except Exception as e:
+                logging.warning(f"Failed to read loudness for [{job.id}] from the library: {e}")
+            self._complete(job, path)
+            return
+
+        # Share the stats dict so encode-stage timings land on the job too
+        fetched.stats.update(job.stats)
+        job.stats = fetched.stats
+
+        # Hand the CPU-bound encode stage to the encode pool and free this
+        # worker for the next network download
+        future: "Future[Path]" = encode_pool.submit(finish_audio, fetched, on_stage, on_progress)
+
+        def done(f: "Future[Path]") -> None:
+            error = f.exception()
+            if error:
+                self._fail(job, error)
+            else:
+                self._complete(job, f.result())
+
+        future.add_done_callback(done)
+
+    def _complete(self, job: Job, final_path: Optional[Path]) -> None:
+        job.result = str(final_path) if final_path else None
+        self._set_state(job, STATE_DONE)
+        metrics.inc(JOBS_COMPLETED)
+        metrics.observe(STAGE_TOTAL, job.finished_at - job.queued_at)
+        logging.info(f"Job [{job.id}] completed in {time.time() - (job.started_at or job.created_at):.2f} seconds: {job.url}")
+
+    def _fail(self, job: Job, error: BaseException) -> None:
+        job.error = str(error)
+        remove_temp_files(job.id)
+        self._set_state(job, STATE_FAILED)
+        metrics.inc(JOBS_FAILED)
+        logging.error(
+            f"Job [{job.id}] failed after {time.time() - (job.started_at or job.created_at):.2f} seconds: {error}",
+            exc_info=error,
+        )
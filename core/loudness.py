@@ -0,0 +1,104 @@
+import json
+import math
+import re
+from typing import Dict, Optional
+
+# What the encode stage does about loudness: nothing, measure it and write
+# ReplayGain tags, or normalize the audio itself
+LOUDNESS_OFF = "off"
+LOUDNESS_TAG = "tag"
+LOUDNESS_APPLY = "apply"
+LOUDNESS_MODES: tuple[str, ...] = (LOUDNESS_OFF, LOUDNESS_TAG, LOUDNESS_APPLY)
+
+# ReplayGain 2.0 plays everything back at -18 LUFS; Opus R128 gains are relative to -23 LUFS
+REPLAYGAIN_REFERENCE: float = -18.0
+R128_REFERENCE: float = -23.0
+
+# Keys of a measurement, as stored in job stats and the library index
+LOUDNESS_LUFS = "loudness_lufs"  # integrated loudness
+TRUE_PEAK_DBFS = "true_peak_dbfs"
+LOUDNESS_RANGE_LU = "loudness_range_lu"
+
+# ebur128 prints a summary like "I: -19.6 LUFS ... LRA: 5.4 LU ... Peak: -0.5 dBFS" when it closes
+_EBUR128_FIELDS = {
+    LOUDNESS_LUFS: re.compile(r"^\s*I:\s+(\S+) LUFS", re.MULTILINE),
+    LOUDNESS_RANGE_LU: re.compile(r"^\s*LRA:\s+(\S+) LU$", re.MULTILINE),
+    TRUE_PEAK_DBFS: re.compile(r"^\s*Peak:\s+(\S+) dBFS", re.MULTILINE),
+}
+# loudnorm with print_format=json prints a JSON object with its input measurements
+_LOUDNORM_JSON = re.compile(r"\{[^{}]*\"input_i\"[^{}]*\}")
+_LOUDNORM_FIELDS = {LOUDNESS_LUFS: "input_i", TRUE_PEAK_DBFS: "input_tp", LOUDNESS_RANGE_LU: "input_lra"}
+
+
+def check_loudness_mode(mode: str) -> None:
+    if mode not in LOUDNESS_MODES:
+        raise ValueError(f"Unsupported loudness mode '{mode}'. Choose one of: {', '.join(LOUDNESS_MODES)}")
+
+
+def analysis_output_args() -> list[str]:
+    """An extra ffmpeg output that measures the input's loudness and discards the audio.
+
+    Added after the real output, it shares that pass's demuxing and decoding, so
+    measuring costs no extra read of the file even when the audio is stream-copied.
+    """
+    return ["-map", "0:a", "-af", "ebur128=peak=true:framelog=quiet", "-f", "null", "-"]
+
+
+def normalize_filter_args(target: float) -> list[str]:
+    """Single-pass loudnorm to target LUFS, with a -1.5 dBTP ceiling.
+
+    loudnorm works at 192 kHz internally, so the output rate is set back explicitly.
+    """
+    return ["-af", f"loudnorm=I={target:g}:TP=-1.5:LRA=11:print_format=json", "-ar", "48000"]
+
+
+def _finite(value: str) -> Optional[float]:
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    # Digital silence measures as -inf, which JSON and SQLite can't hold
+    return number if math.isfinite(number) else None
+
+
+def parse_loudness(stderr: Optional[str]) -> Optional[Dict[str, float]]:
+    """Measurements from ffmpeg's stderr (ebur128 summary or loudnorm JSON), or None if absent"""
+    stderr = stderr or ""
+    values: Dict[str, Optional[float]] = {}
+    summary = stderr.rfind("Summary:")
+    if summary >= 0:
+        for name, pattern in _EBUR128_FIELDS.items():
+            matches = pattern.findall(stderr[summary:])
+            values[name] = _finite(matches[-1]) if matches else None
+    else:
+        found = _LOUDNORM_JSON.findall(stderr)
+        if found:
+            try:
+                data = json.loads(found[-1])
+            except json.JSONDecodeError:
+                return None
+            values = {name: _finite(str(data.get(key, ""))) for name, key in _LOUDNORM_FIELDS.items()}
+    if values.get(LOUDNESS_LUFS) is None:
+        return None
+    return {name: value for name, value in values.items() if value is not None}
+
+
+def replaygain_db(measurement: Dict[str, float]) -> float:
+    return REPLAYGAIN_REFERENCE - measurement[LOUDNESS_LUFS]
+
+
+def replaygain_tag_args(audio_format: str, measurement: Dict[str, float]) -> list[str]:
+    """ffmpeg -metadata arguments carrying the track gain for audio_format"""
+    gain = replaygain_db(measurement)
+    if audio_format == "opus":
+        # Opus players read R128_TRACK_GAIN: Q7.8 fixed point relative to -23 LUFS
+        r128 = max(-32768, min(32767, round((R128_REFERENCE - measurement[LOUDNESS_LUFS]) * 256)))
+        return ["-metadata", f"R128_TRACK_GAIN={r128}"]
+    args = ["-metadata", f"REPLAYGAIN_TRACK_GAIN={gain:+.2f} dB"]
+    if TRUE_PEAK_DBFS in measurement:
+        peak = 10 ** (measurement[TRUE_PEAK_DBFS] / 20)
+        args += ["-metadata", f"REPLAYGAIN_TRACK_PEAK={peak:.6f}"]
+    if audio_format == "m4a":
+        # The mp4 muxer drops tag names it doesn't know unless told to keep them
+        args += ["-movflags", "use_metadata_tags"]
+    return args
@@ -0,0 +1,108 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Any, Iterator, List
+
+# Upper bounds (seconds) of the stage duration histogram buckets
+DURATION_BUCKETS: List[float] = [0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+# Stage names used across the pipeline
+STAGE_QUEUE_WAIT = "queue_wait"
+STAGE_METADATA = "metadata_fetch"
+STAGE_DOWNLOAD = "download"
+STAGE_THUMBNAIL = "thumbnail_conversion"
+STAGE_ENCODE_TAG = "encode_tag"
+STAGE_LOUDNESS = "loudness_tag"
+STAGE_CLEANUP = "cleanup"
+STAGE_TOTAL = "total"
+
+# Counter names
+BYTES_DOWNLOADED = "bytes_downloaded"
+BYTES_WRITTEN = "bytes_written"
+DOWNLOAD_RETRIES = "download_retries"
+JOBS_COMPLETED = "jobs_completed"
+JOBS_FAILED = "jobs_failed"
+CACHE_HITS = "cache_hits"
+METADATA_CACHE_HITS = "metadata_cache_hits"
+
+
+class _Histogram:
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+
+
+class Metrics:
+    """Process-wide stage timings and counters, exported as JSON and Prometheus text."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stages: Dict[str, _Histogram] = {}
+        self._counters: Dict[str, float] = {}
+        self.started_at = time.time()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._stages.setdefault(stage, _Histogram()).observe(seconds)
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    @contextmanager
+    def timed(self, stage: str, timings: Optional[Dict[str, float]] = None) -> Iterator[None]:
+        """Time a block into the stage histogram (and the job's own timings dict, if given)"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            self.observe(stage, elapsed)
+            if timings is not None:
+                timings[stage] = timings.get(stage, 0) + elapsed
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {
+                name: {
+                    "count": h.count,
+                    "total_seconds": h.total,
+                    "avg_seconds": h.total / h.count if h.count else 0.0,
+                    "max_seconds": h.max,
+                }
+                for name, h in self._stages.items()
+            }
+            counters = dict(self._counters)
+        return {"uptime_seconds": time.time() - self.started_at, "stages": stages, "counters": counters}
+
+    def render_prometheus(self, gauges: Optional[Dict[str, float]] = None) -> str:
+        lines: List[str] = []
+        with self._lock:
+            lines.append("# HELP spotifytool_stage_duration_seconds Time spent in each pipeline stage")
+            lines.append("# TYPE spotifytool_stage_duration_seconds histogram")
+            for name, h in sorted(self._stages.items()):
+                for bound, count in zip(DURATION_BUCKETS, h.buckets):
+                    lines.append(f'spotifytool_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+                lines.append(f'spotifytool_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {h.count}')
+                lines.append(f'spotifytool_stage_duration_seconds_sum{{stage="{name}"}} {h.total}')
+                lines.append(f'spotifytool_stage_duration_seconds_count{{stage="{name}"}} {h.count}')
+            for name, value in sorted(self._counters.items()):
+                lines.append(f"# TYPE spotifytool_{name}_total counter")
+                lines.append(f"spotifytool_{name}_total {value}")
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE spotifytool_{name} gauge")
+            lines.append(f"spotifytool_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -0,0 +1,93 @@
+import random
+import re
+import threading
+import time
+import logging
+from typing import Dict, Optional
+
+# yt-dlp failures that will not go away by retrying: the video itself is gone or restricted
+PERMANENT_ERRORS = re.compile(
+    r"private video|video unavailable|has been removed|account associated with this video has been terminated"
+    r"|not available in your country|confirm your age|members[- ]only|join this channel|premieres in"
+    r"|copyright|unsupported url|is not a valid url|http error 404|http error 410",
+    re.IGNORECASE,
+)
+# Failures caused by throttling or the network, worth retrying after a pause
+TRANSIENT_ERRORS = re.compile(
+    r"http error 429|too many requests|http error 403|http error 5\d\d|timed out|timeout"
+    r"|connection (reset|refused|aborted)|temporary failure|name or service not known"
+    r"|remote end closed|incomplete read|not a bot",
+    re.IGNORECASE,
+)
+
+PERMANENT = "permanent"
+TRANSIENT = "transient"
+
+
+class PermanentDownloadError(RuntimeError):
+    """A download failure that retrying cannot fix (private, deleted, region-locked...)"""
+
+
+def classify_error(message: Optional[str]) -> str:
+    """Classify a yt-dlp error message as PERMANENT or TRANSIENT.
+
+    Unknown errors count as transient so they still get retried.
+    """
+    message = message or ""
+    if PERMANENT_ERRORS.search(message) and not TRANSIENT_ERRORS.search(message):
+        return PERMANENT
+    return TRANSIENT
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with full jitter: a random delay up to base * 2**attempt, at most cap"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucket:
+    """Thread-safe token bucket: acquire() blocks until a request may be made.
+
+    Refills at rate tokens per second and holds at most burst tokens, so short
+    bursts go through immediately while the long-run request rate stays bounded.
+    """
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token, sleeping as long as needed; returns the seconds waited"""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class RateLimiter:
+    """One TokenBucket per platform, shared by every worker thread"""
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, platform: str) -> None:
+        with self._lock:
+            bucket = self._buckets.setdefault(platform, TokenBucket(self.rate, self.burst))
+        waited = bucket.acquire()
+        if waited:
+            logging.info(f"Rate limited {platform} request for {waited:.2f}s")
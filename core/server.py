@@ -1,22 +1,41 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import uvicorn
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, AsyncIterator, List, Union
+from contextlib import asynccontextmanager
 import logging
 import asyncio
-import functools
+import json
 
-from core.downloader import download_audio
+from core.jobs import JobQueue, FINISHED_STATES
+from core.metrics import metrics
+from core.loudness import check_loudness_mode
+from core.downloader import (
+    expand_playlist,
+    prefetch_metadata,
+    parse_timestamp,
+    check_clip,
+    storage,
+    library,
+    configure_logging,
+    OUTPUT_FORMATS,
+    DEFAULT_FORMAT,
+)
 
 # Set up logging
-logging.basicConfig(
-    filename="/tmp/spotifytool-server.log",
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s %(message)s"
-)
+configure_logging()
+
+job_queue = JobQueue()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    job_queue.start()
+    yield
+    job_queue.stop()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware to handle browser extension requests
 app.add_middleware(
@@ -30,6 +49,20 @@ app.add_middleware(
 class DownloadRequest(BaseModel):
     url: str
     title: Optional[str] = None
+    audio_format: str = DEFAULT_FORMAT
+    # Optional section to download: seconds or [HH:]MM:SS
+    start: Optional[Union[float, str]] = None
+    end: Optional[Union[float, str]] = None
+    # "off", "tag" (ReplayGain tags) or "apply" (normalize); defaults to SPOTIFYTOOL_LOUDNESS
+    loudness: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    url: str
+    audio_format: str = DEFAULT_FORMAT
+    loudness: Optional[str] = None
+
+class MetadataRequest(BaseModel):
+    urls: List[str]
 
 def identify_platform(url: str) -> str:
     if "youtube.com" in url or "youtu.be" in url:
@@ -39,44 +72,156 @@ def identify_platform(url: str) -> str:
     else:
         raise ValueError("Unsupported platform. Only YouTube and SoundCloud are supported.")
 
+def check_format(audio_format: str) -> None:
+    if audio_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported format '{audio_format}'. Choose one of: {', '.join(OUTPUT_FORMATS)}")
+
 @app.post("/download")
-async def download(request: DownloadRequest) -> Dict[str, str]:
-    import time
-    start_time = time.time()
-    request_id = f"{hash(request.url)}_{hash(request.title or 'notitle')}"
-    logging.info(f"Download requested [{request_id}]: {request.url}, title: {request.title}")
+async def download(request: DownloadRequest) -> Dict[str, Any]:
+    logging.info(f"Download requested: {request.url}, title: {request.title}")
     
     try:
         # Identify platform from URL
         platform = identify_platform(request.url)
-        logging.info(f"Detected platform [{request_id}]: {platform}")
-        
-        # Log before starting download
-        logging.info(f"Starting download process [{request_id}]...")
-        
-        # Run download_audio in thread pool to avoid blocking other requests
-        # Each request gets its own thread, so multiple downloads can run concurrently
+        check_format(request.audio_format)
+        start = parse_timestamp(request.start)
+        end = parse_timestamp(request.end)
+        check_clip(start, end)
+        if request.loudness:
+            check_loudness_mode(request.loudness)
+        storage.check_free()
+    except Exception as e:
+        logging.error(f"Download rejected: {e}")
+        return {"status": "error", "reason": str(e)}
+
+    # Hand the download to the worker pool and return right away;
+    # clients follow progress through /jobs/{job_id}. Submitting reads the
+    # download cache and writes the job journal, so it stays off the event loop
+    loop = asyncio.get_event_loop()
+    job = await loop.run_in_executor(
+        None, job_queue.submit, request.url, request.title, platform, request.audio_format, start, end, request.loudness
+    )
+    logging.info(f"Detected platform [{job.id}]: {platform}")
+    return {"status": "queued", "job_id": job.id, "state": job.state, "position": job_queue.pending()}
+
+@app.post("/download/batch")
+async def download_batch(request: BatchRequest) -> Dict[str, Any]:
+    logging.info(f"Batch download requested: {request.url}")
+    try:
+        platform = identify_platform(request.url)
+        check_format(request.audio_format)
+        if request.loudness:
+            check_loudness_mode(request.loudness)
+        storage.check_free()
+        # One flat extraction lists the tracks; each one becomes a queued job
         loop = asyncio.get_event_loop()
-        
-        # Explicitly handle the download result
-        try:
-            await loop.run_in_executor(
-                None, 
-                functools.partial(download_audio, request.url, title=request.title, platform=platform, request_id=request_id)
-            )
-        except Exception as download_error:
-            # Re-raise download errors to be caught by outer try-catch
-            logging.error(f"Download function failed [{request_id}]: {download_error}")
-            raise download_error
-        
-        elapsed_time = time.time() - start_time
-        logging.info(f"Download completed successfully [{request_id}] in {elapsed_time:.2f} seconds: {request.url}")
-        return {"status": "success", "message": f"Download completed in {elapsed_time:.1f}s"}
+        playlist = await loop.run_in_executor(None, expand_playlist, request.url)
     except Exception as e:
-        elapsed_time = time.time() - start_time
-        error_msg = str(e)
-        logging.error(f"Download failed [{request_id}] after {elapsed_time:.2f} seconds: {error_msg}", exc_info=True)
-        return {"status": "error", "reason": error_msg}
+        logging.error(f"Batch download failed for {request.url}: {e}", exc_info=True)
+        return {"status": "error", "reason": str(e)}
+
+    batch = await loop.run_in_executor(
+        None,
+        job_queue.submit_batch,
+        playlist["url"], playlist["title"], playlist["entries"], platform, request.audio_format, request.loudness,
+    )
+    return {"status": "queued", "batch_id": batch.id, "title": batch.title, "job_ids": batch.job_ids}
+
+@app.get("/batches/{batch_id}")
+async def get_batch(batch_id: str) -> Dict[str, Any]:
+    status = job_queue.batch_status(batch_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Unknown batch {batch_id}")
+    return status
+
+@app.post("/metadata")
+async def metadata(request: MetadataRequest) -> Dict[str, Any]:
+    """Titles/uploaders for many URLs, answered from the cache or one yt-dlp process"""
+    loop = asyncio.get_event_loop()
+    results = await loop.run_in_executor(None, prefetch_metadata, request.urls)
+    return {"metadata": results}
+
+@app.get("/jobs")
+async def list_jobs() -> Dict[str, Any]:
+    return {"jobs": [job.to_dict() for job in job_queue.list()]}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str) -> Dict[str, Any]:
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job.to_dict()
+
+@app.get("/library")
+async def list_library(
+    q: Optional[str] = None,
+    artist: Optional[str] = None,
+    limit: int = 100,
+    offset: int = 0,
+    duplicates: bool = False,
+) -> Dict[str, Any]:
+    """Search the library index; duplicates=true groups files holding the same audio instead"""
+    # SQLite calls block (up to the busy timeout under write contention), so run them off the event loop
+    loop = asyncio.get_event_loop()
+    if duplicates:
+        groups = await loop.run_in_executor(None, library.duplicates)
+        return {"total": len(groups), "duplicates": groups}
+    total, items = await loop.run_in_executor(
+        None, lambda: library.search(q, artist, limit=max(1, min(limit, 1000)), offset=max(0, offset))
+    )
+    return {"total": total, "items": items}
+
+# Seconds between SSE keep-alive comments on idle streams
+SSE_KEEPALIVE: float = 15.0
+
+async def event_stream(request: Request, job_id: Optional[str] = None) -> AsyncIterator[str]:
+    """Server-Sent Events for one job (ending when it finishes) or for all jobs"""
+    queue = job_queue.events.subscribe(job_id)
+    try:
+        # Start with the current state so clients don't miss anything before subscribing
+        jobs = [job_queue.get(job_id)] if job_id else job_queue.list()
+        for job in jobs:
+            if job is None:
+                continue
+            yield f"event: state\ndata: {json.dumps({'type': 'state', 'job_id': job.id, 'job': job.to_dict()})}\n\n"
+            if job_id and job.state in FINISHED_STATES:
+                return
+        while not await request.is_disconnected():
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+            if job_id and event["type"] == "state" and event["job"]["state"] in FINISHED_STATES:
+                return
+    finally:
+        job_queue.events.unsubscribe(queue)
+
+@app.get("/events")
+async def all_events(request: Request) -> StreamingResponse:
+    return StreamingResponse(event_stream(request), media_type="text/event-stream")
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request) -> StreamingResponse:
+    if job_queue.get(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return StreamingResponse(event_stream(request, job_id), media_type="text/event-stream")
+
+def queue_gauges() -> Dict[str, float]:
+    gauges: Dict[str, float] = {"queue_depth": job_queue.pending()}
+    for state, count in job_queue.state_counts().items():
+        gauges[f"jobs_{state}"] = count
+    gauges.update(storage.gauges())
+    return gauges
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics() -> str:
+    return metrics.render_prometheus(queue_gauges())
+
+@app.get("/stats")
+async def stats() -> Dict[str, Any]:
+    return {**metrics.snapshot(), "gauges": queue_gauges()}
 
 @app.get("/health")
 async def health_check() -> Dict[str, str]:
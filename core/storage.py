@@ -0,0 +1,74 @@
+import shutil
+import threading
+import logging
+from pathlib import Path
+from typing import Dict
+
+
+class InsufficientStorageError(RuntimeError):
+    """Not enough free disk space to take on a download"""
+
+
+class StorageManager:
+    """Admission control for disk space.
+
+    Downloads land in scratch_dir (which may be a tmpfs) and finished files in
+    library_dir. Each job reserves its estimated size in scratch space before
+    downloading, and waits while the total reserved would exceed scratch_quota.
+    Jobs are refused outright when a directory would drop below min_free bytes.
+    """
+
+    def __init__(self, library_dir: Path, scratch_dir: Path, min_free: int, scratch_quota: int) -> None:
+        self.library_dir = library_dir
+        self.scratch_dir = scratch_dir
+        self.min_free = min_free
+        self.scratch_quota = scratch_quota
+        self._reserved: Dict[str, int] = {}
+        self._cond = threading.Condition()
+
+    def free_bytes(self, path: Path) -> int:
+        # The directory may not exist yet; measure the nearest existing parent
+        while not path.exists() and path != path.parent:
+            path = path.parent
+        return shutil.disk_usage(path).free
+
+    def reserved_bytes(self) -> int:
+        with self._cond:
+            return sum(self._reserved.values())
+
+    def check_free(self, size: int = 0) -> None:
+        """Raise InsufficientStorageError unless size more bytes fit in both directories"""
+        scratch_needed = size + self.reserved_bytes()
+        for name, path, needed in (("library", self.library_dir, size), ("scratch", self.scratch_dir, scratch_needed)):
+            free = self.free_bytes(path)
+            if free - needed < self.min_free:
+                raise InsufficientStorageError(
+                    f"Not enough disk space in {name} directory {path}: "
+                    f"{free // 2**20} MB free, {needed // 2**20} MB needed plus {self.min_free // 2**20} MB reserve"
+                )
+
+    def reserve(self, job_id: str, size: int) -> None:
+        """Reserve scratch space for a job, blocking while the scratch quota is used up.
+
+        A job bigger than the whole quota still runs, but only on its own.
+        """
+        with self._cond:
+            waited = False
+            while self._reserved and sum(self._reserved.values()) + size > self.scratch_quota > 0:
+                if not waited:
+                    logging.info(f"[{job_id}] Waiting for scratch space ({size // 2**20} MB)")
+                    waited = True
+                self._cond.wait()
+            self._reserved[job_id] = size
+
+    def release(self, job_id: str) -> None:
+        with self._cond:
+            if self._reserved.pop(job_id, None) is not None:
+                self._cond.notify_all()
+
+    def gauges(self) -> Dict[str, float]:
+        return {
+            "library_free_bytes": self.free_bytes(self.library_dir),
+            "scratch_free_bytes": self.free_bytes(self.scratch_dir),
+            "scratch_reserved_bytes": self.reserved_bytes(),
+        }
@@ -0,0 +1,205 @@
+import logging
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Any, Tuple
+
+try:
+    import yt_dlp
+    from yt_dlp.utils import DownloadCancelled, DownloadError
+except ImportError:  # Only the yt-dlp CLI is installed
+    yt_dlp = None
+    DownloadCancelled = DownloadError = Exception
+
+
+def ytdlp_available() -> bool:
+    return yt_dlp is not None
+
+
+class _DeadlinePassed(DownloadCancelled):
+    """Raised inside yt-dlp once a job runs past its timeout. yt-dlp lets
+    cancellations through its own error handling, so it ends the job"""
+
+    msg = "Timed out"
+
+
+class _CollectingLogger:
+    """yt-dlp logger that forwards to logging and keeps errors for the failure message"""
+
+    def __init__(self) -> None:
+        self.errors: List[str] = []
+
+    def debug(self, msg: str) -> None:
+        logging.debug(f"yt-dlp: {msg}")
+
+    def info(self, msg: str) -> None:
+        logging.debug(f"yt-dlp: {msg}")
+
+    def warning(self, msg: str) -> None:
+        logging.warning(f"yt-dlp: {msg}")
+
+    def error(self, msg: str) -> None:
+        self.errors.append(msg)
+        logging.error(f"yt-dlp: {msg}")
+
+
+class _Worker:
+    """One warm YoutubeDL instance. Its extractors keep their HTTP connections and
+    player/signature caches between jobs."""
+
+    def __init__(self, args: List[str]) -> None:
+        # Reuse yt-dlp's own option parser so the CLI and in-process modes share one set of arguments
+        opts: Dict[str, Any] = dict(yt_dlp.parse_options(args).ydl_opts)
+        self.logger = _CollectingLogger()
+        opts.update(logger=self.logger, noprogress=True)
+        self.ydl = yt_dlp.YoutubeDL(opts)
+        self.ydl.add_progress_hook(self._progress_hook)
+        # Every extractor and downloader request goes through urlopen, so checking
+        # the deadline there bounds extractions that make many slow requests
+        self._urlopen = self.ydl.urlopen
+        self.ydl.urlopen = self._checked_urlopen
+        self.on_progress: Optional[Callable[[Dict[str, Any]], None]] = None
+        # time.monotonic() after which the current job is aborted, if any
+        self.deadline: Optional[float] = None
+        self.jobs = 0
+
+    def check_deadline(self) -> None:
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise _DeadlinePassed()
+
+    def _checked_urlopen(self, *args: Any, **kwargs: Any) -> Any:
+        self.check_deadline()
+        response = self._urlopen(*args, **kwargs)
+        # A single slow response is still bounded by --socket-timeout; stop once it arrives
+        try:
+            self.check_deadline()
+        except _DeadlinePassed:
+            response.close()
+            raise
+        return response
+
+    def _progress_hook(self, status: Dict[str, Any]) -> None:
+        # Called for every chunk, so a download that keeps trickling data still stops on time
+        self.check_deadline()
+        if self.on_progress and status.get("status") == "downloading":
+            self.on_progress(status)
+
+    def close(self) -> None:
+        try:
+            self.ydl.close()
+        except Exception as e:
+            logging.warning(f"Failed to close yt-dlp worker: {e}")
+
+
+class YtdlpPool:
+    """Long-lived in-process yt-dlp workers, replacing a cold CLI process per call.
+
+    Workers are keyed by their argument list (format, extractor args, retries...),
+    because yt-dlp fixes things like the format selector when an instance is
+    created. Only the output template changes between jobs. At most max_idle
+    workers are kept across all option sets, evicting the least recently used
+    set first (clip ranges make every section its own set). A worker is recycled
+    after max_jobs uses to bound memory, and dropped after any exception in case
+    it was left in a bad state.
+
+    Jobs take a timeout like the CLI mode's subprocess timeout; running past it
+    raises subprocess.TimeoutExpired.
+    """
+
+    def __init__(self, max_idle: int = 8, max_jobs: int = 50) -> None:
+        self.max_idle = max_idle
+        self.max_jobs = max_jobs
+        self._lock = threading.Lock()
+        # Least recently released option set first
+        self._idle: "OrderedDict[Tuple[str, ...], List[_Worker]]" = OrderedDict()
+        self._idle_count = 0
+
+    def _acquire(self, args: List[str], timeout: Optional[float] = None) -> _Worker:
+        key = tuple(args)
+        worker: Optional[_Worker] = None
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                worker = idle.pop()
+                self._idle_count -= 1
+                if not idle:
+                    del self._idle[key]
+        if worker is None:
+            logging.info(f"Starting yt-dlp worker for: {' '.join(args)}")
+            worker = _Worker(args)
+        worker.deadline = time.monotonic() + timeout if timeout else None
+        # Errors of earlier jobs must not end up in this job's failure message
+        worker.logger.errors.clear()
+        return worker
+
+    def _release(self, args: List[str], worker: _Worker, healthy: bool = True) -> None:
+        worker.jobs += 1
+        worker.on_progress = None
+        worker.deadline = None
+        if not healthy or worker.jobs >= self.max_jobs or self.max_idle <= 0:
+            worker.close()
+            return
+        evicted: List[_Worker] = []
+        with self._lock:
+            key = tuple(args)
+            self._idle.setdefault(key, []).append(worker)
+            self._idle.move_to_end(key)
+            self._idle_count += 1
+            while self._idle_count > self.max_idle:
+                oldest_key, oldest = next(iter(self._idle.items()))
+                evicted.append(oldest.pop(0))
+                self._idle_count -= 1
+                if not oldest:
+                    del self._idle[oldest_key]
+        for stale in evicted:
+            stale.close()
+
+    def extract(self, args: List[str], url: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Extract the info JSON for url, like `yt-dlp --dump-json`"""
+        worker = self._acquire(args, timeout)
+        healthy = False
+        try:
+            info = worker.ydl.extract_info(url, download=False)
+            healthy = True
+            # Read the errors before the worker goes back to the pool and another job clears them
+            if info is None:
+                raise subprocess.CalledProcessError(1, ["yt-dlp", *args, url], stderr="\n".join(worker.logger.errors))
+            return worker.ydl.sanitize_info(info)
+        except _DeadlinePassed:
+            raise subprocess.TimeoutExpired(["yt-dlp", *args, url], timeout or 0)
+        except DownloadError as e:
+            raise subprocess.CalledProcessError(1, ["yt-dlp", *args, url], stderr=str(e))
+        finally:
+            self._release(args, worker, healthy)
+
+    def download(
+        self,
+        args: List[str],
+        outtmpl: str,
+        url: Optional[str] = None,
+        info_file: Optional[str] = None,
+        on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        """Download url (or a saved info JSON, like --load-info-json) to outtmpl.
+
+        Failures raise subprocess.CalledProcessError (or TimeoutExpired) so
+        callers handle both modes the same way.
+        """
+        cmd = ["yt-dlp", *args, "--output", outtmpl] + (["--load-info-json", info_file] if info_file else [url or ""])
+        worker = self._acquire(args, timeout)
+        worker.ydl.params["outtmpl"] = {"default": outtmpl}
+        worker.on_progress = on_progress
+        healthy = False
+        try:
+            retcode = worker.ydl.download_with_info_file(info_file) if info_file else worker.ydl.download([url])
+            healthy = True
+            if retcode:
+                raise subprocess.CalledProcessError(retcode, cmd, stderr="\n".join(worker.logger.errors))
+        except _DeadlinePassed:
+            raise subprocess.TimeoutExpired(cmd, timeout or 0)
+        except DownloadError as e:
+            raise subprocess.CalledProcessError(1, cmd, stderr=str(e))
+        finally:
+            self._release(args, worker, healthy)
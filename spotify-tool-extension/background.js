@@ -2,6 +2,73 @@
 let activeDownloads = new Map(); // downloadId -> {url, title, status, startTime}
 let notificationsSent = new Set(); // Track which downloads already got notifications
 
+const SERVER_URL = 'http://127.0.0.1:5000';
+
+// Tell an open popup to re-render; fails harmlessly when no popup is listening
+function notifyPopup() {
+  chrome.runtime.sendMessage({
+    action: 'downloadsUpdated',
+    downloads: Array.from(activeDownloads.values())
+  }).catch(() => {});
+}
+
+function jobResult(job) {
+  if (job.state === 'done') {
+    return { status: 'success', message: `Download completed in ${job.elapsed_seconds.toFixed(1)}s` };
+  }
+  if (job.state === 'failed') {
+    return { status: 'error', reason: job.error };
+  }
+  return null;
+}
+
+// Follow the job's Server-Sent Events stream until it is done or failed, then resolve
+// with the same {status, message|reason} shape the download endpoint used to return.
+// Service workers have no EventSource, so the stream is read through fetch.
+async function waitForJob(jobId, downloadId) {
+  const response = await fetch(`${SERVER_URL}/jobs/${jobId}/events`);
+  if (!response.ok) {
+    throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+  }
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) {
+      throw new Error('Connection to server lost');
+    }
+    buffer += value;
+    const messages = buffer.split('\n\n');
+    buffer = messages.pop();
+    for (const message of messages) {
+      const dataLine = message.split('\n').find(line => line.startsWith('data: '));
+      if (!dataLine) {
+        continue; // keep-alive comment
+      }
+      const event = JSON.parse(dataLine.slice(6));
+      const download = activeDownloads.get(downloadId);
+      if (event.type === 'progress') {
+        if (download) {
+          download.stage = event.state;
+          download.progress = event;
+          notifyPopup();
+        }
+        continue;
+      }
+      if (download) {
+        download.stage = event.job.state;
+        download.progress = null;
+        notifyPopup();
+      }
+      const result = jobResult(event.job);
+      if (result) {
+        reader.cancel();
+        return result;
+      }
+    }
+  }
+}
+
 chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
   if (request.action === 'openPopup') {
     chrome.action.openPopup();
@@ -52,13 +119,32 @@ chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
     };
     activeDownloads.set(downloadId, downloadInfo);
 
+    // Fill in the real title from the server's metadata cache when the page didn't give one
+    if (!title) {
+      fetch(`${SERVER_URL}/metadata`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ urls: [url] }),
+      })
+      .then(response => response.json())
+      .then(data => {
+        const meta = data.metadata && data.metadata[url];
+        const download = activeDownloads.get(downloadId);
+        if (meta && meta.title && download) {
+          download.title = meta.title;
+          notifyPopup();
+        }
+      })
+      .catch(() => {});
+    }
+
     // Update badge to show active download count
     chrome.action.setBadgeText({ text: activeDownloads.size.toString() });
     chrome.action.setBadgeBackgroundColor({ color: '#FF6B35' });
 
     // Send to server
     console.log('Sending download request:', { url, title });
-    fetch('http://127.0.0.1:5000/download', {
+    fetch(`${SERVER_URL}/download`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -83,6 +169,17 @@ chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
         throw new Error('Invalid JSON response from server');
       }
     })
+    .then(data => {
+      // The server queues the job and answers immediately; follow it until it finishes
+      if (data.status === 'queued') {
+        const download = activeDownloads.get(downloadId);
+        if (download) {
+          download.jobId = data.job_id;
+        }
+        return waitForJob(data.job_id, downloadId);
+      }
+      return data;
+    })
     .then(data => {
       // Update download status
       const download = activeDownloads.get(downloadId);
@@ -126,6 +223,8 @@ chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
           sendResponse({ error: data.reason || 'Server error', downloadId });
         }
         
+        notifyPopup();
+
         // Remove completed/failed downloads after 5 seconds
         setTimeout(() => {
           activeDownloads.delete(downloadId);
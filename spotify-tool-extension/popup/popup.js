@@ -26,7 +26,7 @@ document.addEventListener('DOMContentLoaded', () => {
       const elapsed = Math.round((Date.now() - dl.startTime) / 1000);
       const statusIcon = dl.status === 'completed' ? '✅' : 
                         dl.status === 'failed' ? '❌' : '🔄';
-      const statusText = dl.status === 'downloading' ? `${elapsed}s` : 
+      const statusText = dl.status === 'downloading' ? progressText(dl, elapsed) : 
                         dl.status === 'completed' ? 'Done' : 'Failed';
       
       return `
@@ -44,22 +44,29 @@ document.addEventListener('DOMContentLoaded', () => {
     }).join('');
   }
 
-  // Refresh downloads list every second while popup is open (only if there are active downloads)
-  const refreshInterval = setInterval(async () => {
-    const response = await chrome.runtime.sendMessage({ action: 'getActiveDownloads' });
-    const activeCount = response.downloads.filter(d => d.status === 'downloading').length;
-    
-    if (activeCount === 0) {
-      // No active downloads, refresh less frequently
-      setTimeout(loadActiveDownloads, 2000);
-    } else {
-      loadActiveDownloads();
+  // Live progress pushed by the server, e.g. "42% · 1.8 MB/s · 12s left"
+  function progressText(dl, elapsed) {
+    const progress = dl.progress;
+    if (!progress || progress.percent == null) {
+      return dl.stage ? `${dl.stage.replace('_', ' ')} · ${elapsed}s` : `${elapsed}s`;
     }
-  }, 1000);
+    const parts = [`${Math.round(progress.percent)}%`];
+    if (typeof progress.speed === 'number') {
+      parts.push(`${(progress.speed / 1024 / 1024).toFixed(1)} MB/s`);
+    } else if (progress.speed) {
+      parts.push(progress.speed);
+    }
+    if (progress.eta != null) {
+      parts.push(`${Math.round(progress.eta)}s left`);
+    }
+    return parts.join(' · ');
+  }
 
-  // Clear interval when popup closes
-  window.addEventListener('beforeunload', () => {
-    clearInterval(refreshInterval);
+  // The background worker pushes updates as server events arrive, so no polling is needed
+  chrome.runtime.onMessage.addListener((message) => {
+    if (message.action === 'downloadsUpdated') {
+      displayDownloads(message.downloads);
+    }
   });
 
   downloadBtn.addEventListener('click', async () => {